@@ -43,3 +43,16 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ['name', 'email', 'post', 'created', 'active']
     list_filter = ['active', 'created', 'updated']
     search_fields = ['name', 'email', 'body']
+    actions = ['activate_comments', 'deactivate_comments']
+
+    # Массовые действия обновляют счетчики active_comments постов
+    # через CommentQuerySet.set_active()
+    @admin.action(description='Activate selected comments')
+    def activate_comments(self, request, queryset):
+        updated = queryset.set_active(True)
+        self.message_user(request, f'{updated} comment(s) activated.')
+
+    @admin.action(description='Deactivate selected comments')
+    def deactivate_comments(self, request, queryset):
+        updated = queryset.set_active(False)
+        self.message_user(request, f'{updated} comment(s) deactivated.')
@@ -0,0 +1,196 @@
+"""
+Кеширование блога. Кеш (settings.CACHES) общий для всех рабочих процессов,
+поэтому записи сбрасываются сигналами сразу после изменения данных,
+а не по истечении времени жизни.
+
+Полностраничный кеш (cache_anonymous_page) хранит одну копию страницы для
+всех анонимных читателей. Персональные и часто меняющиеся части страницы
+заменяются в ней метками и подставляются при каждой выдаче:
+* токен CSRF формы комментария – токеном текущего посетителя;
+* боковая панель – актуальным фрагментом из кеша blog_sidebar.
+Статические части страницы заранее сжаты блоками deflate, поэтому ответ
+в gzip собирается без повторного сжатия всей страницы.
+
+Метки изменений (bump_stamps) – время последнего изменения постов,
+комментариев и тегов, которое сигналы записывают в кеш. По ним декоратор
+conditional_page вычисляет ETag и Last-Modified и отвечает 304 Not Modified
+до выполнения представления и запросов к БД.
+"""
+import hashlib
+import re
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+
+# Имя фрагмента {% cache None blog_sidebar %} в blog/sidebar.html
+SIDEBAR_FRAGMENT = 'blog_sidebar'
+
+CSRF_PLACEHOLDER = b'<!--blog:csrf-token-->'
+SIDEBAR_PLACEHOLDER = b'<!--blog:sidebar-placeholder-->'
+CSRF_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+SIDEBAR_RE = re.compile(rb'<!--blog:sidebar-->.*?<!--/blog:sidebar-->', re.S)
+PLACEHOLDER_RE = re.compile(b'(%s|%s)' % (re.escape(CSRF_PLACEHOLDER),
+                                          re.escape(SIDEBAR_PLACEHOLDER)))
+LIST_GENERATION_KEY = 'blog:page:list-generation'
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+# Метки изменений: посты, комментарии, теги (включая схожие посты)
+STAMPS = ('posts', 'comments', 'tags')
+
+
+def invalidate_sidebar():
+    cache.delete(make_template_fragment_key(SIDEBAR_FRAGMENT))
+
+
+def _deflate(data):
+    # Блоки deflate без признака последнего блока, выровненные по байту:
+    # такие куски можно склеивать в один поток
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _deflate_end():
+    return zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+
+
+def _is_anonymous(request):
+    # Без сессионной cookie пользователь не может быть аутентифицирован;
+    # проверка не требует обращения к хранилищу сессий
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def _page_key(request, scope):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    if scope == 'list':
+        return f'blog:page:list:{list_generation()}:{path}'
+    return page_key(request.path)
+
+
+def page_key(path):
+    return 'blog:page:' + hashlib.md5(path.encode()).hexdigest()
+
+
+def list_generation():
+    # Номер поколения, вытесненный из кеша, начинается с нового уникального
+    # значения: с 1 снова стали бы действительны старые страницы списков
+    return cache.get_or_set(LIST_GENERATION_KEY, time.time_ns(), None)
+
+
+def invalidate_lists():
+    # Списки постов и страницы тегов: ключи включают номер поколения,
+    # поэтому достаточно его увеличить
+    try:
+        cache.incr(LIST_GENERATION_KEY)
+    except ValueError:
+        cache.set(LIST_GENERATION_KEY, time.time_ns(), None)
+
+
+def invalidate_pages(paths):
+    # Страницы постов по их адресам (Post.get_absolute_url())
+    cache.delete_many([page_key(path) for path in paths])
+
+
+def _make_entry(response):
+    content = CSRF_RE.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+    content = SIDEBAR_RE.sub(SIDEBAR_PLACEHOLDER, content)
+    segments = [(part, _deflate(part) if part not in (CSRF_PLACEHOLDER,
+                                                      SIDEBAR_PLACEHOLDER) else None)
+                for part in PLACEHOLDER_RE.split(content) if part]
+    return {'content_type': response['Content-Type'], 'segments': segments}
+
+
+def _serve_entry(request, entry):
+    gzip = getattr(settings, 'BLOG_PAGE_CACHE_GZIP', True) and \
+        'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    parts, compressed = [], []
+    for part, deflated in entry['segments']:
+        if part == CSRF_PLACEHOLDER:
+            part = get_token(request).encode()
+        elif part == SIDEBAR_PLACEHOLDER:
+            part = SIDEBAR_RE.search(render_to_string('blog/sidebar.html').encode()).group()
+        parts.append(part)
+        if gzip:
+            compressed.append(deflated if deflated is not None else _deflate(part))
+    content = b''.join(parts)
+    if gzip:
+        trailer = struct.pack('<II', zlib.crc32(content), len(content) & 0xffffffff)
+        response = HttpResponse(GZIP_HEADER + b''.join(compressed) + _deflate_end() + trailer,
+                                content_type=entry['content_type'])
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(content, content_type=entry['content_type'])
+    patch_vary_headers(response, ['Cookie', 'Accept-Encoding'])
+    return response
+
+
+def cache_anonymous_page(scope):
+    """
+    Кеширует страницу для анонимных посетителей.
+    scope='post' – страница поста, ключ по пути; сбрасывается
+    invalidate_pages(). scope='list' – списки постов, ключ по пути
+    с параметрами и поколению списков; сбрасываются invalidate_lists()."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not _is_anonymous(request):
+                return view(request, *args, **kwargs)
+            key = _page_key(request, scope)
+            entry = cache.get(key)
+            if entry is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming:
+                    cache.set(key, _make_entry(response),
+                              getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 600))
+                patch_vary_headers(response, ['Cookie'])
+                return response
+            return _serve_entry(request, entry)
+
+        return wrapper
+
+    return decorator
+
+
+def bump_stamps(*names):
+    now = time.time()
+    cache.set_many({f'blog:stamp:{name}': now for name in names}, None)
+
+
+def get_stamps(names):
+    keys = [f'blog:stamp:{name}' for name in names]
+    stamps = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in stamps}
+    if missing:
+        # Метка, вытесненная из кеша, начинается заново с текущего времени:
+        # клиенты один раз получат страницу целиком
+        cache.set_many(missing, None)
+        stamps.update(missing)
+    return [stamps[key] for key in keys]
+
+
+def conditional_page(*names, csrf=False):
+    """
+    Условный GET по меткам изменений names. Если csrf=True, ETag учитывает
+    cookie CSRF: страница содержит токен, выданный для этой cookie."""
+    names = names or STAMPS
+
+    def etag(request, *args, **kwargs):
+        parts = [repr(stamp) for stamp in get_stamps(names)]
+        if csrf:
+            parts.append(request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+        return hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(max(get_stamps(names)), tz=timezone.utc)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
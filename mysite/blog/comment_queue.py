@@ -0,0 +1,76 @@
+"""
+Очередь новых комментариев. post_comment только проверяет пост и форму
+и добавляет комментарий в очередь – отдельный файл SQLite
+settings.BLOG_COMMENT_QUEUE, так что всплеск комментариев не захватывает
+блокировку записи основной БД на каждый запрос. Команда process_comment_queue забирает комментарии
+пакетами и сохраняет каждый пакет одним bulk_create
+(CommentQuerySet.create_batch) со счетчиками и сбросом кешей один раз
+на пакет.
+
+Записи удаляются из очереди только после фиксации транзакции основной БД,
+поэтому при сбое обработчика комментарии не теряются (но пакет может быть
+сохранен повторно). Очередь рассчитана на один обработчик.
+"""
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+from django.conf import settings
+from .models import Comment, Post
+
+SCHEMA = ('CREATE TABLE IF NOT EXISTS comment_queue ('
+          'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+          'post_id INTEGER NOT NULL, '
+          'data TEXT NOT NULL)')
+
+
+def enabled():
+    return bool(getattr(settings, 'BLOG_COMMENT_QUEUE', None))
+
+
+def connect():
+    path = Path(settings.BLOG_COMMENT_QUEUE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Автоматическая фиксация каждой команды; журнал WAL не блокирует
+    # чтение очереди во время записи, synchronous=FULL – fsync при фиксации
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=FULL')
+    connection.execute(SCHEMA)
+    return connection
+
+
+def enqueue(post_id, data):
+    """
+    Добавляет в очередь комментарий к посту post_id; data – очищенные
+    данные CommentForm."""
+    with closing(connect()) as connection:
+        connection.execute('INSERT INTO comment_queue (post_id, data) VALUES (?, ?)',
+                           (post_id, json.dumps(data)))
+
+
+def pending():
+    with closing(connect()) as connection:
+        return connection.execute('SELECT COUNT(*) FROM comment_queue').fetchone()[0]
+
+
+def process(batch_size=100):
+    """
+    Сохраняет следующий пакет комментариев из очереди. Комментарии
+    к постам, удаленным или снятым с публикации после постановки
+    в очередь, отбрасываются. Возвращает число
+    обработанных записей очереди."""
+    with closing(connect()) as connection:
+        rows = connection.execute('SELECT id, post_id, data FROM comment_queue '
+                                  'ORDER BY id LIMIT ?', (batch_size,)).fetchall()
+        if not rows:
+            return 0
+        published = set(Post.published.filter(id__in={post_id for _, post_id, _ in rows})
+                        .values_list('id', flat=True))
+        comments = [Comment(post_id=post_id, **json.loads(data))
+                    for _, post_id, data in rows if post_id in published]
+        if comments:
+            Comment.objects.create_batch(comments)
+        connection.execute('DELETE FROM comment_queue WHERE id <= ?', (rows[-1][0],))
+        return len(rows)
@@ -20,25 +20,72 @@ URL-адреса по их имени и передавать опциональ
 лонного фильтра truncatewords_html(), чтобы сокращать описание постов
 пос ле 30 слов, избегая незакрытых HTML-тегов.
 """
-import markdown
 from django.contrib.syndication.views import Feed
-from django.template.defaultfilters import truncatewords_html
-from django.urls import reverse_lazy
+from django.shortcuts import get_object_or_404
+from django.urls import reverse, reverse_lazy
+from django.utils.feedgenerator import Atom1Feed
+from taggit.models import Tag
 from .models import Post
 
+# Готовый XML лент кешируется целиком (caching.cache_anonymous_page('list')
+# в urls.py) и строится заново только после изменения опубликованных постов.
+# Описания элементов – сохраненные отрывки постов (Post.excerpts), общие
+# для всех лент, поэтому Markdown при построении ленты не выполняется.
+
+
 class LatestPostsFeed(Feed):
     title = 'My blog'
     link = reverse_lazy('blog:post_list')
     description = 'New posts of my blog.'
 
     def items(self):
-        return Post.published.all()[:5]
+        return Post.published.for_listing().prefetch_related('tags')[:5]
 
     def item_title(self, item):
         return item.title
 
     def item_description(self, item):
-        return truncatewords_html(markdown.markdown(item.body), 30)
+        return item.get_excerpt(30)
 
     def item_pubdate(self, item):
         return item.publish
+
+    def item_updateddate(self, item):
+        return item.updated
+
+    def item_categories(self, item):
+        return [tag.name for tag in item.tags.all()]
+
+
+class TagPostsFeed(LatestPostsFeed):
+    """
+    Последние посты с тегом: tag/<slug>/feed/."""
+
+    def get_object(self, request, tag_slug):
+        return get_object_or_404(Tag, slug=tag_slug)
+
+    def title(self, tag):
+        return f'My blog: posts tagged with "{tag.name}"'
+
+    def link(self, tag):
+        return reverse('blog:post_list_by_tag', args=[tag.slug])
+
+    def description(self, tag):
+        return f'New posts of my blog tagged with "{tag.name}".'
+
+    def items(self, tag):
+        # Один запрос постов и один – их тегов для всей ленты
+        return Post.published.for_listing().filter(tags__in=[tag]) \
+            .prefetch_related('tags')[:5]
+
+
+class AtomLatestPostsFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostsFeed.description
+
+
+class AtomTagPostsFeed(TagPostsFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, tag):
+        return self.description(tag)
@@ -0,0 +1,146 @@
+"""
+Файлы поисковых индексов блога в каталоге settings.BLOG_INDEX_DIR.
+Индексы читаются всеми рабочими процессами через отображение в память
+(mmap), поэтому файлы никогда не перезаписываются на месте: новая версия
+пишется во временный файл и атомарно подменяется через os.replace().
+"""
+import json
+import mmap
+import os
+import secrets
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+# Возраст временного файла или каталога (секунды), после которого он
+# считается оставшимся от упавшего процесса
+STALE_TEMP = 24 * 3600
+
+
+def index_dir(name):
+    path = Path(settings.BLOG_INDEX_DIR) / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def atomic_write(path, data):
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_json(path, value):
+    atomic_write(path, json.dumps(value).encode('utf-8'))
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, 'rb') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def map_file(path):
+    """
+    Содержимое файла, отображенное в память, в виде memoryview."""
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # Пустой файл нельзя отобразить в память
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def switch_version(directory, current):
+    """
+    Делает версию индекса current ({роль: имя файла или каталога})
+    действующей: новая версия становится видна процессам одной атомарной
+    заменой файла CURRENT, после чего удаляются файлы версий старше
+    предыдущей. Файлы предыдущей версии остаются до следующего
+    переключения: процесс, прочитавший прежний CURRENT, еще может их
+    открывать. Вызывается под IndexLock."""
+    previous = read_json(directory / 'CURRENT', {})
+    write_json(directory / 'CURRENT', current)
+    keep = {name for version in (current, previous) for name in version.values() if name}
+    for path in directory.iterdir():
+        # Имена с точкой – блокировка и временные файлы и каталоги, которые
+        # другой процесс еще пишет; они удаляются, только если остались
+        # от упавшего процесса
+        if path.name in keep or path.name == 'CURRENT' \
+                or path.name.startswith('.') and not _is_stale(path):
+            continue
+        if path.is_dir():
+            remove_files(path.iterdir())
+            try:
+                path.rmdir()
+            except OSError:
+                pass
+        else:
+            remove_files([path])
+
+
+def _is_stale(path):
+    try:
+        return time.time() - os.path.getmtime(path) > STALE_TEMP
+    except OSError:
+        return False
+
+
+def remove_files(paths):
+    # На Windows файл, отображенный в память другим процессом, удалить
+    # нельзя; такой файл будет удален при следующей очистке
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class IndexLock:
+    """
+    Межпроцессная блокировка на время изменения индекса: файл,
+    создаваемый с O_EXCL, с уникальным токеном владельца. Блокировка
+    старше stale секунд считается оставшейся от упавшего процесса
+    и снимается; владелец удаляет файл, только если тот еще его."""
+
+    def __init__(self, directory, timeout=30, stale=300):
+        self.path = Path(directory) / '.lock'
+        self.timeout = timeout
+        self.stale = stale
+        self.token = None
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        token = secrets.token_hex(16)
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, 'w') as f:
+                    f.write(token)
+                self.token = token
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale:
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Index lock {self.path} is busy')
+                time.sleep(0.05)
+
+    def __exit__(self, *exc_info):
+        # Блокировку, снятую как устаревшую, мог уже взять другой процесс
+        try:
+            with open(self.path) as f:
+                if f.read() == self.token:
+                    os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.token = None
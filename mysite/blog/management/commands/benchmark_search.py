@@ -0,0 +1,51 @@
+import random
+import statistics
+import tempfile
+import time
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from blog.search import inverted
+
+
+class Command(BaseCommand):
+    help = ('Измеряет время поиска встроенного индекса (blog/search/inverted.py) '
+            'на синтетических постах. Индекс строится во временном каталоге, '
+            'БД не используется.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--words', type=int, default=150,
+                            help='Число слов в теле поста.')
+        parser.add_argument('--vocabulary', type=int, default=50000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, posts, words, vocabulary, queries, seed, **options):
+        rng = random.Random(seed)
+        terms = [f'w{i}' for i in range(vocabulary)]
+        # Частоты слов по закону Ципфа, как в текстах на естественном языке
+        weights = list(accumulate(1 / rank for rank in range(1, vocabulary + 1)))
+
+        def text(length):
+            return ' '.join(rng.choices(terms, cum_weights=weights, k=length))
+
+        rows = ((post_id, text(8), text(words)) for post_id in range(1, posts + 1))
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(BLOG_INDEX_DIR=directory):
+            started = time.perf_counter()
+            inverted.build_index(rows)
+            self.stdout.write(f'Built index of {posts} post(s) '
+                              f'in {time.perf_counter() - started:.1f} s.')
+            index = inverted.get_index()
+            timings = []
+            for _ in range(queries):
+                query = text(rng.randint(1, 3))
+                started = time.perf_counter()
+                index.search(query, 201)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(f'{queries} queries: p50 {statistics.median(timings):.2f} ms, '
+                          f'p99 {p99:.2f} ms, max {timings[-1]:.2f} ms.')
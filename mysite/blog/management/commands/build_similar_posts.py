@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from blog.similarity import build_similar_posts
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу схожих постов по общим тегам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('-k', type=int, default=None,
+                            help='Число схожих постов на пост.')
+
+    def handle(self, *args, batch_size, k, **options):
+        total = build_similar_posts(batch_size=batch_size, k=k)
+        self.stdout.write(f'Stored {total} similar post link(s).')
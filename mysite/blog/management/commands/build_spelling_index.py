@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from blog.search.spelling import build_index
+
+
+class Command(BaseCommand):
+    help = 'Строит словарь подсказок «Did you mean» для поиска.'
+
+    def handle(self, *args, **options):
+        total = build_index()
+        self.stdout.write(f'Indexed {total} word(s).')
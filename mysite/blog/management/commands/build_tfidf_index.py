@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from blog.tfidf import build_index, merge_delta
+
+
+class Command(BaseCommand):
+    help = 'Строит индекс TF-IDF для поиска схожих по содержимому постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--merge', action='store_true',
+                            help='Не строить индекс заново, а слить дельту с базой, если '
+                                 'в ней больше BLOG_TFIDF_MAX_DELTA постов.')
+        parser.add_argument('--force', action='store_true',
+                            help='С --merge: слить непустую дельту независимо от размера.')
+
+    def handle(self, *args, merge, force, **options):
+        if merge:
+            merged = merge_delta(force=force)
+            if merged is None:
+                self.stdout.write('Nothing to merge.')
+            else:
+                self.stdout.write(f'Merged {merged} post(s) into the base.')
+            return
+        total = build_index()
+        self.stdout.write(f'Indexed {total} post(s).')
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from blog import comment_queue
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет комментарии из очереди BLOG_COMMENT_QUEUE пакетами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Ждать новых комментариев, проверяя очередь '
+                                 'каждые N секунд; 0 – выйти, когда очередь пуста.')
+
+    def handle(self, *args, batch_size, interval, **options):
+        total = 0
+        while True:
+            processed = comment_queue.process(batch_size)
+            total += processed
+            if processed:
+                continue
+            if not interval:
+                break
+            time.sleep(interval)
+        self.stdout.write(f'Processed {total} comment(s).')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from blog.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Строит заново поисковый индекс текущей реализации поиска (BLOG_SEARCH_BACKEND).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compact', action='store_true',
+                            help='Перестроить индекс, только если журнал изменений '
+                                 'длиннее BLOG_SEARCH_MAX_JOURNAL.')
+
+    def handle(self, *args, compact, **options):
+        backend = get_backend()
+        total = backend.compact() if compact else backend.rebuild()
+        if total is None:
+            self.stdout.write('Index is up to date.')
+        else:
+            self.stdout.write(f'Indexed {total} post(s).')
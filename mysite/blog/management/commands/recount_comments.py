@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from blog.caching import bump_stamps, invalidate_lists, invalidate_sidebar
+from blog.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики активных комментариев постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        active_comments = Comment.objects.filter(post=OuterRef('pk'), active=True) \
+            .order_by().values('post').annotate(total=Count('pk')).values('total')
+        pks = list(Post.objects.order_by('pk').values_list('pk', flat=True))
+        fixed = []
+        for start in range(0, len(pks), batch_size):
+            # Только посты, счетчик которых разошелся с числом комментариев
+            drifted = list(Post.objects.filter(pk__in=pks[start:start + batch_size])
+                           .annotate(total=Coalesce(Subquery(active_comments), 0))
+                           .exclude(active_comments=F('total'))
+                           .values_list('pk', flat=True))
+            Post.objects.filter(pk__in=drifted) \
+                .update(active_comments=Coalesce(Subquery(active_comments), 0))
+            # update() не отправляет сигналы: страницы постов со старым
+            # числом комментариев сбрасываются здесь
+            Post.objects.filter(pk__in=drifted).invalidate_pages()
+            fixed.extend(drifted)
+        invalidate_sidebar()
+        if fixed:
+            invalidate_lists()
+            bump_stamps('comments')
+        self.stdout.write(f'Recounted comments for {len(pks)} post(s), '
+                          f'fixed {len(fixed)}.')
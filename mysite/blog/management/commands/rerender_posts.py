@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from blog.caching import bump_stamps, invalidate_lists
+from blog.models import Post
+from blog.rendering import renderer_version
+
+
+class Command(BaseCommand):
+    help = 'Перерисовывает сохраненный HTML постов, устаревший после ' \
+           'изменения конфигурации Markdown.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--force', action='store_true',
+                            help='Перерисовать все посты, а не только устаревшие.')
+
+    def handle(self, *args, batch_size, force, **options):
+        posts = Post.objects.all()
+        if not force:
+            posts = posts.exclude(body_html_version=renderer_version())
+        pks = list(posts.order_by('pk').values_list('pk', flat=True))
+        total = 0
+        for start in range(0, len(pks), batch_size):
+            batch = list(Post.objects.filter(pk__in=pks[start:start + batch_size])
+                         .only('pk', 'body', *Post.RENDERED_FIELDS))
+            changed = [post for post in batch if post.render_body(force=force)]
+            Post.objects.bulk_update(changed, Post.RENDERED_FIELDS)
+            # bulk_update не отправляет сигналы: кешированные страницы постов,
+            # списки и ленты с прежним HTML сбрасываются здесь
+            Post.objects.filter(pk__in=[post.pk for post in changed]).invalidate_pages()
+            total += len(changed)
+        if total:
+            invalidate_lists()
+            bump_stamps('posts')
+        self.stdout.write(f'Re-rendered {total} post(s).')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from blog.search import corpus_generation, search_stats
+
+
+class Command(BaseCommand):
+    help = 'Выводит статистику кеша результатов поиска.'
+
+    def handle(self, *args, **options):
+        stats = search_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+        self.stdout.write(f"Hits: {stats['hits']}, misses: {stats['misses']}, "
+                          f"hit ratio: {ratio:.1%}, generation: {corpus_generation()}.")
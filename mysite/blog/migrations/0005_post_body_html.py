@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_post_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='body_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='body_html_version',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_post_body_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpts',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
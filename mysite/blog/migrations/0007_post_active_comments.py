@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:27
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_active_comments(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    active_comments = Comment.objects.filter(post=OuterRef('pk'), active=True) \
+        .order_by().values('post').annotate(total=Count('pk')).values('total')
+    Post.objects.update(active_comments=Coalesce(Subquery(active_comments), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_excerpts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='active_comments',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-active_comments'], name='blog_post_status_9c88ca_idx'),
+        ),
+        migrations.RunPython(count_active_comments, migrations.RunPython.noop),
+    ]
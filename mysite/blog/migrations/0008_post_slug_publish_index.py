@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_post_active_comments'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=models.SlugField(db_index=False, max_length=250, unique_for_date='publish'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['slug', 'publish'], name='blog_post_slug_publish_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_post_slug_publish_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shared_tags', models.PositiveIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_links', to='blog.post')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+            ],
+            options={
+                'ordering': ['rank'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarpost',
+            constraint=models.UniqueConstraint(fields=('post', 'rank'), name='blog_similarpost_post_rank_uniq'),
+        ),
+    ]
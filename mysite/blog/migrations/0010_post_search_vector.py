@@ -0,0 +1,69 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:38
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+# Индексы создаются только в PostgreSQL, поэтому объявлены здесь, а не в Meta
+INDEXES = [
+    ('blog_post_search_vector_idx', 'USING gin (search_vector)'),
+    ('blog_post_title_trgm_idx', 'USING gin (title gin_trgm_ops)'),
+]
+
+
+def enable_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+def fill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Post = apps.get_model('blog', 'Post')
+    last_id = 0
+    while True:
+        # Пакеты по первичному ключу, каждый в своей короткой транзакции
+        ids = list(Post.objects.filter(pk__gt=last_id).order_by('pk')
+                   .values_list('pk', flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        with transaction.atomic():
+            Post.objects.filter(pk__in=ids).update(
+                search_vector=SearchVector('title', weight='A') +
+                              SearchVector('body', weight='B'))
+        last_id = ids[-1]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, using in INDEXES:
+            schema_editor.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON blog_post {using}')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, _ in INDEXES:
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('blog', '0009_similarpost'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_trigram, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+# Полнотекстовый индекс FTS5 для SQLite (blog/search/sqlite.py). Таблица
+# хранит только индекс, текст берется из blog_post (content='blog_post').
+# Если последующая миграция пересоздаст таблицу blog_post (в SQLite так
+# выполняется большинство изменений столбцов), триггеры нужно создать заново.
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS blog_post_fts USING fts5("
+    "title, body, content='blog_post', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS blog_post_fts_insert AFTER INSERT ON blog_post BEGIN "
+    "INSERT INTO blog_post_fts(rowid, title, body) VALUES (new.id, new.title, new.body); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS blog_post_fts_delete AFTER DELETE ON blog_post BEGIN "
+    "INSERT INTO blog_post_fts(blog_post_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS blog_post_fts_update AFTER UPDATE OF title, body ON blog_post BEGIN "
+    "INSERT INTO blog_post_fts(blog_post_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO blog_post_fts(rowid, title, body) VALUES (new.id, new.title, new.body); "
+    "END",
+    # Индексация уже существующих постов
+    "INSERT INTO blog_post_fts(blog_post_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS blog_post_fts_insert',
+    'DROP TRIGGER IF EXISTS blog_post_fts_delete',
+    'DROP TRIGGER IF EXISTS blog_post_fts_update',
+    'DROP TABLE IF EXISTS blog_post_fts',
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREATE_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_post_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('active', True)), fields=['post', 'created'], name='blog_comment_post_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created'], name='blog_commen_created_0e6ed4_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+from blog.rendering import content_hash, render_markdown, renderer_version
+
+BATCH_SIZE = 500
+
+
+def backfill_body_html(apps, schema_editor):
+    # Посты, созданные до миграции 0005, иначе прорисовывались бы
+    # на каждый запрос, пока не запущена команда rerender_posts
+    Post = apps.get_model('blog', 'Post')
+    version = renderer_version()
+    pks = list(Post.objects.filter(body_hash='').order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(pks), BATCH_SIZE):
+        posts = list(Post.objects.filter(pk__in=pks[start:start + BATCH_SIZE])
+                     .only('pk', 'body'))
+        for post in posts:
+            post.body_html = render_markdown(post.body)
+            post.body_hash = content_hash(post.body)
+            post.body_html_version = version
+        Post.objects.bulk_update(posts, ['body_html', 'body_hash', 'body_html_version'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_comment_post_active_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_body_html, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+from blog.rendering import render_excerpts
+
+BATCH_SIZE = 500
+
+
+def backfill_excerpts(apps, schema_editor):
+    # Отрывки постов, прорисованных до миграции 0006: без них списки
+    # постов загружали бы HTML и обрезали его на каждый запрос
+    Post = apps.get_model('blog', 'Post')
+    pks = list(Post.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(pks), BATCH_SIZE):
+        posts = [post for post in Post.objects.filter(pk__in=pks[start:start + BATCH_SIZE])
+                 .only('pk', 'body_html', 'excerpts')
+                 if not post.excerpts]
+        for post in posts:
+            post.excerpts = render_excerpts(post.body_html)
+        Post.objects.bulk_update(posts, ['excerpts'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_backfill_body_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import migrations
+
+from blog.similarity import TagIncidence
+
+BATCH_SIZE = 1000
+
+
+def backfill_similar_posts(apps, schema_editor):
+    # Схожие посты для уже существующих постов: без них блок «Similar posts»
+    # пуст, пока не запущена команда build_similar_posts
+    Post = apps.get_model('blog', 'Post')
+    SimilarPost = apps.get_model('blog', 'SimilarPost')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    content_type = ContentType.objects.filter(app_label='blog', model='post').first()
+    if content_type is None:
+        # Типы содержимого создаются после миграций: в новой БД постов нет
+        return
+    published = Post.objects.filter(status='PB')
+    pairs = list(TaggedItem.objects.filter(content_type=content_type,
+                                           object_id__in=published.values('id'))
+                 .values_list('object_id', 'tag_id'))
+    incidence = TagIncidence(pairs, dict(published.values_list('id', 'publish')))
+    k = getattr(settings, 'BLOG_SIMILAR_POSTS', 4)
+    SimilarPost.objects.all().delete()
+    for start in range(0, len(incidence.post_ids), BATCH_SIZE):
+        batch = incidence.post_ids[start:start + BATCH_SIZE]
+        SimilarPost.objects.bulk_create(
+            SimilarPost(post_id=post_id, similar_id=similar_id, shared_tags=shared, rank=rank)
+            for post_id, similar_id, shared, rank in zip(*(column.tolist() for column
+                                                           in incidence.top_k(batch, k))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_backfill_excerpts'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0005_auto_20220424_2025'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_similar_posts, migrations.RunPython.noop),
+    ]
@@ -26,14 +26,61 @@ author__username.
 9.
 """
 
-from django.db import models
+from collections import Counter
+
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
 from taggit.managers import TaggableManager
+from django.template.defaultfilters import truncatewords_html
+from .caching import bump_stamps, invalidate_pages, invalidate_sidebar
+from .rendering import content_hash, render_excerpts, render_markdown, renderer_version
+
+
+def loaded_values(instance):
+    # Значения полей, как они сохранены в БД (без отложенных полей)
+    deferred = instance.get_deferred_fields()
+    return {field.attname: field.value_from_object(instance)
+            for field in instance._meta.concrete_fields
+            if field.attname not in deferred}
+
+
+class PostQuerySet(models.QuerySet):
+    def for_listing(self):
+        # Спискам постов достаточно заголовка и сохраненных отрывков,
+        # полный текст, HTML и вектор поиска поста не загружаются
+        return self.defer('body', 'body_html', 'search_vector')
+
+    def with_related(self):
+        # Автор и теги загружаются для всей страницы сразу (JOIN и один
+        # дополнительный запрос), а не отдельным запросом на каждый пост
+        return self.select_related('author').prefetch_related('tags')
+
+    def add_active_comments(self, delta):
+        # Атомарное изменение счетчика на стороне БД: UPDATE ... SET
+        # active_comments = active_comments + delta. Уменьшение не опускает
+        # разошедшийся счетчик ниже нуля: поле положительное, и на СУБД
+        # с ограничением CHECK UPDATE завершился бы IntegrityError
+        if delta < 0:
+            return self.update(active_comments=Greatest(F('active_comments') + delta, 0))
+        return self.update(active_comments=F('active_comments') + delta)
+
+    def update_search_vector(self):
+        # Вектор вычисляется в PostgreSQL одним UPDATE по текущим title и body
+        return self.update(search_vector=SearchVector('title', weight='A') +
+                                         SearchVector('body', weight='B'))
+
+    def invalidate_pages(self):
+        # Сброс кешированных страниц постов (blog/caching.py)
+        invalidate_pages([post.get_absolute_url()
+                          for post in self.only('publish', 'slug')])
 
 
-class PublishedManager(models.Manager):
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     def get_queryset(self):
         return super().get_queryset() \
             .filter(status=Post.Status.PUBLISHED)
@@ -49,7 +96,7 @@ class PublishedManager(models.Manager):
 
 class Post(models.Model):
     tags = TaggableManager()  # Менеджер tags позволит добавлять, извлекать и удалять теги из объектов Post.
-    objects = models.Manager()  # менеджер, применяемый по умолчанию
+    objects = PostQuerySet.as_manager()  # менеджер, применяемый по умолчанию
     published = PublishedManager()  # конкретно-прикладной менеджер
 
     class Status(models.TextChoices):
@@ -58,7 +105,8 @@ class Post(models.Model):
 
     title = models.CharField(max_length=250)  # транслируется в столбец VARCHAR в базе дан-ных SQL
     slug = models.SlugField(max_length=250,
-                            unique_for_date='publish')  # короткая метка, транслируется в столбец VARCHAR в базе дан-ных SQL. Обратите внимание,
+                            unique_for_date='publish',
+                            db_index=False)  # короткая метка, транслируется в столбец VARCHAR в базе дан-ных SQL. Обратите внимание,
     # что поле publish является экземпляром класса DateTimeField, но проверка на
     # уникальность значений будет выполняться только по дате (не по времени).
     # Django будет предотвращать сохранение нового поста с тем же именем, что
@@ -85,17 +133,110 @@ class Post(models.Model):
                               # В этом поле статус DRAFT используется в качестве предустановленного вари-
                               # анта, если не указан иной.
                               default=Status.DRAFT)
+    # Заранее прорисованный HTML тела поста. Пересчитывается при сохранении,
+    # если изменился текст (body_hash) или конфигурация Markdown (body_html_version).
+    body_html = models.TextField(blank=True, editable=False)
+    body_hash = models.CharField(max_length=64, blank=True, editable=False)
+    body_html_version = models.CharField(max_length=16, blank=True, editable=False)
+    # Отрывки HTML для списков: {"12": "...", "30": "..."}, см. BLOG_EXCERPT_WORDS
+    excerpts = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Число активных комментариев. Поддерживается сигналами модели Comment
+    # и CommentQuerySet.set_active(), пересчитывается командой recount_comments
+    active_comments = models.PositiveIntegerField(default=0, editable=False)
+    # Взвешенный вектор полнотекстового поиска PostgreSQL: title – вес A,
+    # body – вес B. Обновляется в save(); в других СУБД остается пустым.
+    # Индексы GIN по нему и по title (gin_trgm_ops) создаются в миграции 0010
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    RENDERED_FIELDS = ['body_html', 'excerpts', 'body_hash', 'body_html_version']
+    COUNTER_FIELDS = ['active_comments']
+    # Поля, которые вычисляются на стороне БД и не записываются при save()
+    DATABASE_FIELDS = COUNTER_FIELDS + ['search_vector']
 
     class Meta:
         ordering = ['-publish']  # сортировать результаты по полю publish
         indexes = [
             # позволяет определять в модели индексы базы данных, которые могут содержать одно или несколько полей в возрастающем либо убывающем порядке
             models.Index(fields=['-publish']),
+            # «Самые комментируемые посты» читаются по индексу без агрегации
+            models.Index(fields=['status', '-active_comments']),
+            # Поиск поста по слагу и диапазону дат публикации в post_detail;
+            # заменяет одиночный индекс по slug
+            models.Index(fields=['slug', 'publish'], name='blog_post_slug_publish_idx'),
         ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding \
+                and not kwargs.get('force_insert'):
+            # Счетчики и вектор поиска изменяются только выражениями, поэтому
+            # при обычном сохранении поста их устаревшие значения не записываются
+            deferred = self.get_deferred_fields()
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key
+                             and field.attname not in deferred
+                             and field.name not in self.DATABASE_FIELDS]
+            kwargs['update_fields'] = update_fields
+        if self.render_body() and update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | set(self.RENDERED_FIELDS)
+        search_changed = self.has_changed('title', 'body') and \
+            (update_fields is None or {'title', 'body'} & set(update_fields))
+        super().save(*args, **kwargs)
+        if search_changed and connection.vendor == 'postgresql':
+            Post.objects.filter(pk=self.pk).update_search_vector()
+        # Обработчики post_save уже сравнили новые значения с прежними
+        self._loaded_values = loaded_values(self)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Загруженные значения нужны обработчикам сигналов (has_changed)
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def has_changed(self, *fields):
+        """
+        Изменились ли поля по сравнению со значениями, загруженными из БД.
+        Для нового объекта всегда True."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+        return any(loaded[field] != getattr(self, field)
+                   for field in fields if field in loaded)
+
+    def render_body(self, force=False):
+        """
+        Обновляет body_html, если он устарел. Возвращает True, если HTML
+        был пересчитан."""
+        body_hash = content_hash(self.body)
+        version = renderer_version()
+        if not force and self.body_hash == body_hash \
+                and self.body_html_version == version:
+            return False
+        self.body_html = render_markdown(self.body)
+        self.excerpts = render_excerpts(self.body_html)
+        self.body_hash = body_hash
+        self.body_html_version = version
+        return True
+
+    def get_body_html(self):
+        # Устаревший HTML (например, после смены расширений Markdown до запуска
+        # команды rerender_posts) не показываем, а прорисовываем тело заново.
+        if self.body_html_version == renderer_version():
+            return self.body_html
+        return render_markdown(self.body)
+
+    def get_excerpt(self, words):
+        if self.body_html_version == renderer_version():
+            excerpt = self.excerpts.get(str(words))
+            if excerpt is not None:
+                return excerpt
+        return truncatewords_html(self.get_body_html(), words)
+
     # Django будет использовать этот метод
     # для отображения имени объекта во многих местах, таких как его сайт адми-
     # нистрирования.
@@ -119,7 +260,48 @@ class Post(models.Model):
 # га. Идентификатор id объекта Post был включен в качестве позиционного
 # аргумента, используя параметр args=[self.id].
 
+class CommentQuerySet(models.QuerySet):
+    def set_active(self, active):
+        """
+        Массово включает или отключает комментарии, изменяя счетчики
+        active_comments затронутых постов одним UPDATE на пост."""
+        changed = self.exclude(active=active)
+        with transaction.atomic():
+            per_post = list(changed.order_by()
+                            .values_list('post')
+                            .annotate(total=Count('pk')))
+            updated = changed.update(active=active)
+            for post_id, total in per_post:
+                Post.objects.filter(pk=post_id) \
+                    .add_active_comments(total if active else -total)
+        # update() не отправляет сигналы post_save
+        invalidate_sidebar()
+        bump_stamps('comments')
+        Post.objects.filter(pk__in=[post_id for post_id, _ in per_post]) \
+            .invalidate_pages()
+        return updated
+
+    def create_batch(self, comments):
+        """
+        Сохраняет пакет комментариев одним INSERT. bulk_create() не отправляет
+        сигналы, поэтому счетчики active_comments, кеши и метка изменений
+        обновляются здесь один раз на пакет."""
+        with transaction.atomic():
+            created = self.bulk_create(comments)
+            per_post = Counter(comment.post_id for comment in created if comment.active)
+            for post_id, total in per_post.items():
+                Post.objects.filter(pk=post_id).add_active_comments(total)
+        invalidate_sidebar()
+        bump_stamps('comments')
+        Post.objects.filter(pk__in={comment.post_id for comment in created}) \
+            .invalidate_pages()
+        return created
+
+
 class Comment(models.Model):
+    # Индекс внешнего ключа остается: частичный индекс
+    # blog_comment_post_active_idx не подходит для запросов без active=True
+    # (каскадное удаление поста, неактивные комментарии, фильтр в admin)
     post = models.ForeignKey(Post,
                              on_delete=models.CASCADE,
                              related_name='comments')
@@ -130,16 +312,45 @@ class Comment(models.Model):
     updated = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=True)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ['created']
-
-    indexes = [
-        models.Index(fields=['created']),
-    ]
+        indexes = [
+            models.Index(fields=['created']),
+            # Активные комментарии поста по порядку created – одним
+            # упорядоченным проходом по индексу (post_detail, post_comments).
+            # Частичный индекс вместо (post, active, created): фильтр
+            # active=True Django передает как WHERE "active", и SQLite
+            # не использует по такому условию столбец active индекса
+            models.Index(fields=['post', 'created'], condition=models.Q(active=True),
+                         name='blog_comment_post_active_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.name} on {self.post}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Запоминаем загруженные значения, чтобы при сохранении знать,
+        # изменились ли пост и активность комментария
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = loaded_values(self)
+
+    def counter_state(self):
+        """
+        Пост и активность комментария в том виде, в каком они хранятся в БД,
+        либо None для несохраненного комментария."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return loaded.get('post_id', self.post_id), loaded.get('active', self.active)
+
 
 """
 Это модель Comment. Поле ForeignKey было добавлено для того, чтобы свя-
@@ -155,3 +366,27 @@ all(). Если атрибут related_name не определен, то Django
 имя модели в нижнем регистре, за которым следует _set (то есть comment_set),
 чтобы именовать взаимосвязь ассоциированного объекта с объектом модели,
 в которой эта взаимосвязь была определена."""
+
+
+class SimilarPost(models.Model):
+    """
+    Заранее рассчитанные схожие посты (по числу общих тегов),
+    см. blog/similarity.py."""
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='similar_links')
+    similar = models.ForeignKey(Post,
+                                on_delete=models.CASCADE,
+                                related_name='+')
+    shared_tags = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['rank']
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'rank'],
+                                    name='blog_similarpost_post_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.similar} is similar to {self.post}'
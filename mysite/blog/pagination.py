@@ -0,0 +1,150 @@
+"""
+Постраничная разбивка по курсору (keyset pagination).
+В отличие от Paginator, не выполняет COUNT(*) и OFFSET: следующая страница
+выбирается условием по значениям полей сортировки последнего показанного
+объекта, например (publish, id) < (p, i), поэтому страница 10 000 стоит
+столько же, сколько первая. Курсор – непрозрачная строка в base64.
+"""
+import base64
+import json
+
+from django.db.models import Q
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    def __init__(self, object_list, number, paginator,
+                 has_next, has_previous):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<Cursor page {self.number}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1],
+                                            NEXT, self.number + 1)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return self.paginator.encode_cursor(self.object_list[0],
+                                            PREVIOUS, self.number - 1)
+
+
+class CursorPaginator:
+    def __init__(self, queryset, per_page, ordering=('-publish', '-id')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def encode_cursor(self, obj, direction, number):
+        model = self.queryset.model
+        values = [model._meta.get_field(name).value_to_string(obj)
+                  for name, _ in self._fields()]
+        payload = json.dumps([direction, number, values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        model = self.queryset.model
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, number, raw_values = json.loads(
+                base64.urlsafe_b64decode(padded.encode()))
+            fields = self._fields()
+            if direction not in (NEXT, PREVIOUS) or len(raw_values) != len(fields):
+                raise InvalidCursor(cursor)
+            values = [model._meta.get_field(name).to_python(value)
+                      for (name, _), value in zip(fields, raw_values)]
+            return direction, max(int(number), 1), values
+        except InvalidCursor:
+            raise
+        except Exception as exc:
+            raise InvalidCursor(cursor) from exc
+
+    def _seek(self, values, direction):
+        # (f1 < v1) OR (f1 = v1 AND f2 < v2) OR ... для убывающих полей
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self._fields(), values):
+            after = descending == (direction == NEXT)
+            lookup = f'{name}__lt' if after else f'{name}__gt'
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else f'-{name}'
+                for name in self.ordering]
+
+    def page(self, cursor=None):
+        """
+        Возвращает страницу для курсора. Пустой или некорректный курсор
+        дает первую страницу."""
+        if cursor:
+            try:
+                direction, number, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                return self.first_page()
+        else:
+            return self.first_page()
+        if direction == NEXT:
+            rows = list(self.queryset.filter(self._seek(values, NEXT))
+                        .order_by(*self.ordering)[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], number, self,
+                              has_next=len(rows) > self.per_page,
+                              has_previous=True)
+        rows = list(self.queryset.filter(self._seek(values, PREVIOUS))
+                    .order_by(*self._reversed_ordering())[:self.per_page + 1])
+        if len(rows) <= self.per_page:
+            # Перед курсором не осталось полной страницы – это начало списка
+            return self.first_page()
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return CursorPage(rows, number, self,
+                          has_next=True, has_previous=True)
+
+    def first_page(self):
+        rows = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+        return CursorPage(rows[:self.per_page], 1, self,
+                          has_next=len(rows) > self.per_page,
+                          has_previous=False)
@@ -0,0 +1,54 @@
+"""
+Рендеринг Markdown-тела поста в HTML.
+Результат хранится в модели Post (поле body_html) и пересчитывается только
+тогда, когда меняется текст поста (body_hash) или конфигурация рендерера
+(body_html_version), поэтому шаблоны и новостная лента больше не вызывают
+markdown.markdown() на каждый запрос.
+"""
+import hashlib
+import json
+
+import markdown
+from django.conf import settings
+from django.template.defaultfilters import truncatewords_html
+
+
+def get_markdown_extensions():
+    return list(getattr(settings, 'BLOG_MARKDOWN_EXTENSIONS', []))
+
+
+def get_markdown_extension_configs():
+    return dict(getattr(settings, 'BLOG_MARKDOWN_EXTENSION_CONFIGS', {}))
+
+
+def get_excerpt_words():
+    return sorted(getattr(settings, 'BLOG_EXCERPT_WORDS', (12, 30)))
+
+
+def renderer_version():
+    # Отпечаток конфигурации: версия библиотеки markdown, расширения, их настройки
+    # и длины сохраняемых отрывков
+    config = {
+        'markdown': markdown.__version__,
+        'extensions': get_markdown_extensions(),
+        'extension_configs': get_markdown_extension_configs(),
+        'excerpt_words': get_excerpt_words(),
+    }
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def render_markdown(text):
+    return markdown.markdown(text,
+                             extensions=get_markdown_extensions(),
+                             extension_configs=get_markdown_extension_configs())
+
+
+def render_excerpts(html):
+    # Отрывки для списков постов, поиска и новостной ленты: {число слов: HTML}
+    return {str(words): truncatewords_html(html, words)
+            for words in get_excerpt_words()}
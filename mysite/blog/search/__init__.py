@@ -0,0 +1,125 @@
+"""
+Поиск постов для представления post_search. Реализация выбирается
+настройкой BLOG_SEARCH_BACKEND (путь к классу-наследнику SearchBackend),
+а если она не задана – по СУБД: PostgreSQL (blog/search/postgres.py) или
+SQLite FTS5 (blog/search/sqlite.py).
+
+Функция search() кеширует списки идентификаторов найденных постов по
+нормализованному запросу и номеру поколения опубликованных постов;
+поколение увеличивается сигналами при каждом изменении опубликованного
+поста, поэтому устаревшие списки просто перестают читаться. Так же
+кешируются фрагменты текста с выделенными словами запроса (snippets()),
+которые вычисляются только для постов показываемой страницы.
+"""
+import hashlib
+import time
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils.module_loading import import_string
+from .base import highlight
+
+BACKENDS = {
+    'postgresql': 'blog.search.postgres.PostgresSearchBackend',
+    'sqlite': 'blog.search.sqlite.SqliteSearchBackend',
+}
+GENERATION_KEY = 'blog:search:generation'
+STATS_KEYS = {'hits': 'blog:search:hits', 'misses': 'blog:search:misses'}
+
+_backends = {}
+
+
+def backend_path():
+    path = getattr(settings, 'BLOG_SEARCH_BACKEND', None) or BACKENDS.get(connection.vendor)
+    if path is None:
+        raise ImproperlyConfigured(
+            f'No search backend for {connection.vendor}, set BLOG_SEARCH_BACKEND.')
+    return path
+
+
+def get_backend():
+    path = backend_path()
+    backend = _backends.get(path)
+    if backend is None:
+        backend = _backends[path] = import_string(path)()
+    return backend
+
+
+def normalize_query(query):
+    # Одинаковые по смыслу запросы («Django  ORM», «django orm», запросы
+    # с полноширинными символами) дают один ключ кеша
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+
+def corpus_generation():
+    # Поколение, вытесненное из кеша, начинается с нового уникального
+    # значения, иначе снова читались бы результаты первого поколения
+    return cache.get_or_set(GENERATION_KEY, time.time_ns(), None)
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def _count(name):
+    key = STATS_KEYS[name]
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def search_stats():
+    stats = cache.get_many(STATS_KEYS.values())
+    return {name: stats.get(key, 0) for name, key in STATS_KEYS.items()}
+
+
+def search(query):
+    """
+    Идентификаторы опубликованных постов по запросу в порядке убывания
+    релевантности (не больше BLOG_SEARCH_MAX_RESULTS) и признак того, что
+    найдено больше. Результат берется из кеша, если опубликованные посты
+    не менялись с момента такого же запроса."""
+    query = normalize_query(query)
+    limit = getattr(settings, 'BLOG_SEARCH_MAX_RESULTS', 200)
+    digest = hashlib.md5(f'{backend_path()}\n{limit}\n{query}'.encode()).hexdigest()
+    key = f'blog:search:{corpus_generation()}:{digest}'
+    result = cache.get(key)
+    if result is not None:
+        _count('hits')
+        return result
+    _count('misses')
+    # Лишний идентификатор показывает, что результатов больше лимита
+    post_ids = get_backend().search(query, limit + 1)
+    result = post_ids[:limit], len(post_ids) > limit
+    cache.set(key, result, getattr(settings, 'BLOG_SEARCH_CACHE_TIMEOUT', 3600))
+    return result
+
+
+def snippets(post_ids, query):
+    """
+    Фрагменты тел постов post_ids с выделенными словами запроса в виде
+    безопасного HTML: {id поста: фрагмент}. Кешируются по посту
+    и нормализованному запросу."""
+    query = normalize_query(query)
+    digest = hashlib.md5(f'{backend_path()}\n{query}'.encode()).hexdigest()
+    prefix = f'blog:snippet:{corpus_generation()}:{digest}:'
+    cached = cache.get_many([f'{prefix}{post_id}' for post_id in post_ids])
+    result = {post_id: cached[f'{prefix}{post_id}'] for post_id in post_ids
+              if f'{prefix}{post_id}' in cached}
+    missing = [post_id for post_id in post_ids if post_id not in result]
+    if missing:
+        found = get_backend().snippets(missing, query)
+        # Посты без совпадений в теле тоже кешируются, пустой строкой
+        found = {post_id: found.get(post_id, '') for post_id in missing}
+        cache.set_many({f'{prefix}{post_id}': snippet for post_id, snippet in found.items()},
+                       getattr(settings, 'BLOG_SEARCH_CACHE_TIMEOUT', 3600))
+        result.update(found)
+    return {post_id: highlight(snippet) for post_id, snippet in result.items() if snippet}
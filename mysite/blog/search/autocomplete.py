@@ -0,0 +1,165 @@
+"""
+Подсказки при наборе поискового запроса: заголовки опубликованных постов
+и имена тегов, начинающиеся с введенного текста (или содержащие слово,
+начинающееся с него).
+
+Подсказки хранятся в отсортированном списке ключей, поиск по префиксу
+выполняется через bisect. Список общий для рабочих процессов: он лежит
+в кеше вместе с номером версии, а каждый процесс держит копию в памяти
+и перечитывает ее, только когда версия изменилась. Сигналы изменения
+постов и тегов правят список на месте (update_post, update_tag, remove)
+под межпроцессной блокировкой IndexLock. Если блокировка занята, правка
+не выполняется: список помечается устаревшим и строится заново из БД
+при следующем запросе подсказок.
+"""
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from taggit.models import Tag
+from ..index_storage import IndexLock, index_dir
+from ..models import Post
+from . import normalize_query
+
+ENTRIES_KEY = 'blog:autocomplete:entries'
+VERSION_KEY = 'blog:autocomplete:version'
+STALE_KEY = 'blog:autocomplete:stale'
+# Время ожидания блокировки в обработчиках сигналов, секунды
+LOCK_TIMEOUT = 1
+# Подсказка находится и по любому из первых MAX_WORDS слов заголовка
+MAX_WORDS = 8
+
+
+def _entries(kind, object_id, label, url):
+    words = normalize_query(label).split()
+    return [(' '.join(words[i:]), kind, object_id, label, url)
+            for i in range(min(len(words), MAX_WORDS))]
+
+
+def _post_entries(post):
+    return _entries('post', post.id, post.title, post.get_absolute_url())
+
+
+def _tag_entries(tag):
+    return _entries('tag', tag.id, tag.name,
+                    reverse('blog:post_list_by_tag', args=[tag.slug]))
+
+
+class PrefixIndex:
+    def __init__(self, entries):
+        # entries отсортированы: (ключ, вид, id, текст, адрес)
+        self.entries = entries
+        self.keys = [entry[0] for entry in entries]
+
+    def complete(self, prefix, limit):
+        prefix = normalize_query(prefix)
+        if not prefix:
+            return []
+        suggestions = []
+        seen = set()
+        position = bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(suggestions) < limit \
+                and self.keys[position].startswith(prefix):
+            _, kind, object_id, label, url = self.entries[position]
+            if (kind, object_id) not in seen:
+                seen.add((kind, object_id))
+                suggestions.append({'type': kind, 'label': label, 'url': url})
+            position += 1
+        return suggestions
+
+
+def build_entries():
+    entries = []
+    for post in Post.published.only('title', 'slug', 'publish'):
+        entries.extend(_post_entries(post))
+    for tag in Tag.objects.all():
+        entries.extend(_tag_entries(tag))
+    entries.sort()
+    return entries
+
+
+def _publish(entries):
+    timeout = getattr(settings, 'BLOG_AUTOCOMPLETE_TIMEOUT', 86400)
+    cache.set_many({ENTRIES_KEY: entries, VERSION_KEY: time.time_ns()}, timeout)
+
+
+_local = {'version': None, 'index': None}
+
+
+def _rebuild():
+    # Вызывается под блокировкой; метка снимается до чтения БД, поэтому
+    # изменение, отложенное во время построения, вызовет еще одно
+    cache.delete(STALE_KEY)
+    entries = build_entries()
+    _publish(entries)
+    return entries
+
+
+def _lock(timeout=LOCK_TIMEOUT):
+    return IndexLock(index_dir('autocomplete'), timeout=timeout)
+
+
+def get_index():
+    """
+    Индекс подсказок текущей версии. Из кеша он читается только при смене
+    версии, из БД строится, только если в кеше его нет или он помечен
+    устаревшим."""
+    values = cache.get_many([VERSION_KEY, STALE_KEY])
+    version = values.get(VERSION_KEY)
+    if STALE_KEY in values:
+        try:
+            with _lock(timeout=0):
+                _rebuild()
+            version = cache.get(VERSION_KEY)
+        except TimeoutError:
+            # Список строит или правит другой процесс
+            pass
+    if version is not None and version == _local['version']:
+        return _local['index']
+    entries = cache.get(ENTRIES_KEY) if version is not None else None
+    if entries is None:
+        entries = build_entries()
+        _publish(entries)
+        version = cache.get(VERSION_KEY)
+    _local.update(version=version, index=PrefixIndex(entries))
+    return _local['index']
+
+
+def _replace(kind, object_id, new_entries):
+    try:
+        with _lock():
+            if cache.get(STALE_KEY) is not None:
+                _rebuild()
+                return
+            entries = cache.get(ENTRIES_KEY)
+            if entries is None:
+                # Списка нет в кеше – он будет построен при следующем запросе
+                return
+            entries = [entry for entry in entries
+                       if entry[1] != kind or entry[2] != object_id]
+            for entry in new_entries:
+                insort(entries, entry)
+            _publish(entries)
+    except TimeoutError:
+        # Без блокировки правка могла бы затереть чужую; изменение уже
+        # зафиксировано в БД и попадет в список при его построении
+        cache.set(STALE_KEY, time.time_ns(), None)
+
+
+def update_post(post):
+    published = post.status == Post.Status.PUBLISHED
+    _replace('post', post.id, _post_entries(post) if published else [])
+
+
+def update_tag(tag):
+    _replace('tag', tag.id, _tag_entries(tag))
+
+
+def remove(kind, object_id):
+    _replace(kind, object_id, [])
+
+
+def complete(prefix):
+    return get_index().complete(prefix, getattr(settings, 'BLOG_AUTOCOMPLETE_LIMIT', 10))
@@ -0,0 +1,72 @@
+import re
+
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from ..models import Post
+
+TERM_RE = re.compile(r'\w+')
+# Границы выделения найденных слов: управляющие символы не встречаются
+# в тексте постов и не изменяются при экранировании HTML
+START, STOP = '\x02', '\x03'
+# Длина фрагмента в словах
+SNIPPET_WORDS = 30
+
+
+def highlight(text):
+    """
+    Фрагмент с границами START/STOP в безопасный HTML: текст
+    экранируется, границы заменяются тегами <mark>."""
+    return mark_safe(escape(text).replace(START, '<mark>').replace(STOP, '</mark>'))
+
+
+class SearchBackend:
+    """
+    Поисковая реализация: по запросу возвращает идентификаторы
+    опубликованных постов в порядке убывания релевантности."""
+
+    def search(self, query, limit=None):
+        raise NotImplementedError
+
+    def snippets(self, post_ids, query):
+        """
+        Фрагменты тел постов post_ids с выделенными словами запроса:
+        {id поста: текст с границами START/STOP}. Реализация по умолчанию
+        выбирает окно вокруг первого найденного слова на Python."""
+        terms = set(TERM_RE.findall(query.casefold()))
+        snippets = {}
+        for post_id, body in Post.objects.filter(id__in=post_ids).values_list('id', 'body'):
+            words = list(TERM_RE.finditer(body))
+            first = next((i for i, word in enumerate(words)
+                          if word.group().casefold() in terms), None)
+            if first is None:
+                continue
+            window = words[max(first - SNIPPET_WORDS // 3, 0):][:SNIPPET_WORDS]
+            parts = ['…' if window[0].start() else '']
+            position = window[0].start()
+            for word in window:
+                parts.append(body[position:word.start()])
+                if word.group().casefold() in terms:
+                    parts.append(START + word.group() + STOP)
+                else:
+                    parts.append(word.group())
+                position = word.end()
+            if position < len(body):
+                parts.append('…')
+            snippets[post_id] = ''.join(parts)
+        return snippets
+
+    def update_posts(self, post_ids):
+        """
+        Вызывается после фиксации изменений постов post_ids. Реализациям,
+        индекс которых поддерживает сама СУБД, ничего делать не нужно."""
+
+    def rebuild(self):
+        """
+        Строит индекс заново. Возвращает число проиндексированных постов."""
+        raise NotImplementedError
+
+    def compact(self):
+        """
+        Перестраивает индекс, если накопленные изменения этого требуют.
+        Возвращает число проиндексированных постов или None."""
+        return None
@@ -0,0 +1,338 @@
+"""
+Встроенный поисковый индекс на чистом Python для установок без
+PostgreSQL: обратный индекс по заголовку и телу опубликованных постов
+с ранжированием BM25.
+
+Индекс хранится в каталоге BLOG_INDEX_DIR/inverted:
+* base-<версия>/ – неизменяемая база, отображаемая в память каждым рабочим
+  процессом: postings.bin – списки вхождений термов (номера документов
+  разностями и частоты, в кодировке varint), doc_ids.bin и doc_lengths.bin –
+  массивы идентификаторов постов и длин документов, terms.json – словарь
+  (терм -> смещение списка, число документов и длина списка), meta.json –
+  статистика. Для частых термов (больше BLOG_SEARCH_CHAMPIONS документов)
+  хранится только список «чемпионов» – документов с наибольшим вкладом
+  терма в BM25: разбор полного списка частого слова на чистом Python
+  занимал бы десятки миллисекунд, а его вклад в оценку мал;
+* journal-<версия>.jsonl – журнал, в который дописываются изменения постов
+  после построения базы; записи журнала перекрывают документы базы;
+* CURRENT – имена действующих базы и журнала.
+Команда rebuild_search_index строит базу заново; сигналы сохранения
+и удаления постов дописывают журнал, а команда rebuild_search_index
+--compact, запускаемая периодически, перестраивает индекс при росте
+журнала сверх BLOG_SEARCH_MAX_JOURNAL.
+"""
+import heapq
+import json
+import math
+import os
+import re
+import time
+from array import array
+from collections import Counter
+from operator import itemgetter
+
+from django.conf import settings
+from ..index_storage import (IndexLock, atomic_write, index_dir, map_file, read_json,
+                             switch_version, write_json)
+from ..models import Post
+from .base import SearchBackend
+
+TERM_RE = re.compile(r'\w+')
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return TERM_RE.findall(text.casefold())
+
+
+def document_terms(title, body):
+    # Слова заголовка учитываются дважды
+    return tokenize(title) * 2 + tokenize(body)
+
+
+def encode_varints(values, out):
+    for value in values:
+        while value > 0x7f:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(data):
+    values = []
+    value = shift = 0
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        else:
+            values.append(value | byte << shift)
+            value = shift = 0
+    return values
+
+
+def term_score(tf, length, average_length):
+    # Вклад терма в BM25 без множителя idf
+    return tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+
+
+class InvertedIndex:
+    def __init__(self, directory, current):
+        self.directory = directory
+        self.current = current
+        base = directory / current['base']
+        vocabulary = read_json(base / 'terms.json', {'terms': [], 'offsets': [0], 'df': []})
+        self.terms = {term: i for i, term in enumerate(vocabulary['terms'])}
+        self.offsets = vocabulary['offsets']
+        self.df = vocabulary['df']
+        self.sizes = vocabulary.get('sizes', self.df)
+        meta = read_json(base / 'meta.json', {})
+        self.documents = meta.get('documents', 0)
+        self.average_length = meta.get('average_length', 0) or 1
+        self.postings = map_file(base / 'postings.bin')
+        self.doc_ids = map_file(base / 'doc_ids.bin').cast('q')
+        self.doc_lengths = map_file(base / 'doc_lengths.bin').cast('I')
+        # Документы из журнала: id поста -> (частоты термов, длина) или None
+        # для поста, исключенного из индекса
+        self.journal = {}
+        self.journal_offset = 0
+        self.read_journal()
+
+    def read_journal(self):
+        """
+        Дочитывает записи, дописанные в журнал после прошлого чтения."""
+        name = self.current.get('journal')
+        if not name:
+            return
+        try:
+            with open(self.directory / name, 'rb') as f:
+                f.seek(self.journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Последняя строка может быть еще не дописана
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            entry = json.loads(line)
+            self.journal[entry['id']] = (entry['terms'], entry['length']) \
+                if entry.get('terms') is not None else None
+        self.journal_offset += end
+
+    def search(self, query, limit=None):
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        documents = max(self.documents, 1)
+        scores = {}
+        doc_lengths = self.doc_lengths
+        norm = K1 * (1 - B)
+        scale = K1 * B / self.average_length
+        for term in terms:
+            position = self.terms.get(term)
+            if position is None:
+                continue
+            df = self.df[position]
+            size = self.sizes[position]
+            idf = math.log(1 + (documents - df + 0.5) / (df + 0.5))
+            values = decode_varints(self.postings[self.offsets[position]:
+                                                  self.offsets[position + 1]])
+            # Первая половина – номера документов разностями, вторая – частоты
+            doc = 0
+            for gap, tf in zip(values[:size], values[size:]):
+                doc += gap
+                scores[doc] = scores.get(doc, 0) + \
+                    idf * tf * (K1 + 1) / (tf + norm + scale * doc_lengths[doc])
+        doc_ids = self.doc_ids
+        results = {doc_ids[doc]: score for doc, score in scores.items()
+                   if doc_ids[doc] not in self.journal}
+        for post_id, entry in self.journal.items():
+            if entry is None:
+                continue
+            counts, length = entry
+            score = 0
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    position = self.terms.get(term)
+                    df = self.df[position] if position is not None else 1
+                    idf = math.log(1 + (documents - df + 0.5) / (df + 0.5))
+                    score += idf * term_score(tf, length, self.average_length)
+            if score:
+                results[post_id] = score
+        key = itemgetter(1, 0)
+        if limit is None:
+            ranked = sorted(results.items(), key=key, reverse=True)
+        else:
+            ranked = heapq.nlargest(limit, results.items(), key=key)
+        return [post_id for post_id, _ in ranked]
+
+
+_loaded = {}
+
+
+def get_index():
+    """
+    Индекс текущей версии или None, если он еще не построен. Версия
+    проверяется по файлу CURRENT при каждом обращении, а журнал
+    дочитывается, так что изменения других процессов видны сразу."""
+    directory = index_dir('inverted')
+    current = read_json(directory / 'CURRENT')
+    if current is None:
+        return None
+    index = _loaded.get(directory)
+    if index is None or index.current != current:
+        index = _loaded[directory] = InvertedIndex(directory, current)
+    else:
+        index.read_journal()
+    return index
+
+
+def _version():
+    return f'{time.time_ns():x}'
+
+
+def _journal_size(directory, current):
+    try:
+        return os.path.getsize(directory / current['journal'])
+    except (TypeError, KeyError, FileNotFoundError):
+        return 0
+
+
+def _read_journal_tail(directory, name, offset):
+    # Полные строки журнала name начиная со смещения offset
+    try:
+        with open(directory / name, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return b''
+    return data[:data.rfind(b'\n') + 1]
+
+
+def _write_base(directory, posts):
+    postings = {}
+    doc_ids = array('q')
+    doc_lengths = array('I')
+    for doc, (post_id, title, body) in enumerate(posts):
+        terms = document_terms(title, body)
+        doc_ids.append(post_id)
+        doc_lengths.append(len(terms))
+        for term, tf in Counter(terms).items():
+            postings.setdefault(term, []).append((doc, tf))
+    average_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0
+    champions = getattr(settings, 'BLOG_SEARCH_CHAMPIONS', 1000)
+    terms = sorted(postings)
+    blob = bytearray()
+    offsets = [0]
+    df = []
+    sizes = []
+    for term in terms:
+        entries = postings[term]
+        df.append(len(entries))
+        if len(entries) > champions:
+            entries = sorted(heapq.nlargest(
+                champions, entries,
+                key=lambda entry: term_score(entry[1], doc_lengths[entry[0]], average_length)))
+        docs = [doc for doc, _ in entries]
+        encode_varints([docs[0]] + [b - a for a, b in zip(docs, docs[1:])], blob)
+        encode_varints([tf for _, tf in entries], blob)
+        offsets.append(len(blob))
+        sizes.append(len(entries))
+    name = f'base-{_version()}'
+    tmp = directory / f'.{name}'
+    tmp.mkdir()
+    atomic_write(tmp / 'postings.bin', bytes(blob))
+    atomic_write(tmp / 'doc_ids.bin', doc_ids.tobytes())
+    atomic_write(tmp / 'doc_lengths.bin', doc_lengths.tobytes())
+    write_json(tmp / 'terms.json', {'terms': terms, 'offsets': offsets,
+                                    'df': df, 'sizes': sizes})
+    write_json(tmp / 'meta.json', {'documents': len(doc_ids),
+                                   'average_length': average_length})
+    os.replace(tmp, directory / name)
+    return name, len(doc_ids)
+
+
+def build_index(posts=None):
+    """
+    Строит индекс по всем опубликованным постам (или по строкам posts:
+    (id, заголовок, тело)). Возвращает число документов.
+
+    Посты читаются без блокировки, чтобы не задерживать запись журнала.
+    Записи, дописанные в журнал после начала чтения, переносятся в журнал
+    новой базы, поэтому изменения, сделанные во время построения,
+    не теряются."""
+    directory = index_dir('inverted')
+    with IndexLock(directory):
+        started = read_json(directory / 'CURRENT') or {}
+        offset = _journal_size(directory, started)
+    if posts is None:
+        posts = Post.published.order_by('id').values_list('id', 'title', 'body') \
+            .iterator(chunk_size=500)
+    name, total = _write_base(directory, posts)
+    with IndexLock(directory):
+        current = read_json(directory / 'CURRENT') or {}
+        if current.get('journal') != started.get('journal'):
+            # Индекс успел перестроить другой процесс: переносится весь его
+            # журнал, записи в нем не старше начала чтения постов
+            offset = 0
+        journal = f'journal-{_version()}.jsonl'
+        tail = _read_journal_tail(directory, current['journal'], offset) \
+            if current.get('journal') else b''
+        atomic_write(directory / journal, tail)
+        switch_version(directory, {'base': name, 'journal': journal})
+    _loaded.pop(directory, None)
+    return total
+
+
+def update_posts(post_ids):
+    """
+    Дописывает в журнал текущее состояние постов post_ids. Неопубликованные
+    и удаленные посты исключаются из индекса."""
+    directory = index_dir('inverted')
+    if read_json(directory / 'CURRENT') is None:
+        return
+    posts = {post_id: (title, body) for post_id, title, body in
+             Post.published.filter(id__in=post_ids).values_list('id', 'title', 'body')}
+    lines = []
+    for post_id in post_ids:
+        entry = {'id': post_id, 'terms': None, 'length': 0}
+        if post_id in posts:
+            terms = document_terms(*posts[post_id])
+            entry.update(terms=Counter(terms), length=len(terms))
+        lines.append(json.dumps(entry) + '\n')
+    with IndexLock(directory):
+        path = directory / read_json(directory / 'CURRENT')['journal']
+        with open(path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def compact():
+    """
+    Перестраивает индекс, если в журнале больше BLOG_SEARCH_MAX_JOURNAL
+    постов. Возвращает число документов или None, если перестройка
+    не нужна. Выполняется командой rebuild_search_index --compact, а не при
+    сохранении поста: перестройка читает все посты."""
+    index = get_index()
+    if index is None or len(index.journal) <= getattr(settings, 'BLOG_SEARCH_MAX_JOURNAL', 1000):
+        return None
+    return build_index()
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    def search(self, query, limit=None):
+        index = get_index()
+        if index is None:
+            return []
+        return index.search(query, limit)
+
+    def update_posts(self, post_ids):
+        update_posts(post_ids)
+
+    def rebuild(self):
+        return build_index()
+
+    def compact(self):
+        return compact()
@@ -0,0 +1,31 @@
+from django.contrib.postgres.search import (SearchHeadline, SearchQuery, SearchRank,
+                                           TrigramSimilarity)
+from django.db.models import F, Q
+from ..models import Post
+from .base import SNIPPET_WORDS, START, STOP, SearchBackend
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Полнотекстовый поиск по сохраненному вектору Post.search_vector
+    (индекс GIN) и поиск по сходству заголовка для запросов с опечатками
+    (оператор %, индекс gin_trgm_ops по title), см. миграцию 0010."""
+
+    def search(self, query, limit=None):
+        search_query = SearchQuery(query, search_type='websearch')
+        post_ids = Post.published.annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+            similarity=TrigramSimilarity('title', query),
+        ).filter(Q(search_vector=search_query) | Q(title__trigram_similar=query)) \
+            .order_by('-rank', '-similarity').values_list('id', flat=True)
+        return list(post_ids[:limit])
+
+    def snippets(self, post_ids, query):
+        headline = SearchHeadline('body', SearchQuery(query, search_type='websearch'),
+                                  start_sel=START, stop_sel=STOP,
+                                  max_words=SNIPPET_WORDS, min_words=SNIPPET_WORDS // 2)
+        return dict(Post.objects.filter(id__in=post_ids)
+                    .annotate(headline=headline).values_list('id', 'headline'))
+
+    def rebuild(self):
+        return Post.objects.update_search_vector()
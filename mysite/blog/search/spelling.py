@@ -0,0 +1,165 @@
+"""
+Подсказки «Did you mean» для поиска без результатов: исправление слов
+запроса по словарю блога методом симметричного удаления (SymSpell).
+
+Для каждого слова словаря (заголовки, тела опубликованных постов и теги)
+заранее вычисляются все варианты с удалением до MAX_DISTANCE символов
+из первых PREFIX_LENGTH символов. Слово запроса, которого нет в словаре,
+порождает свои варианты удаления; слова словаря с совпадающими вариантами –
+кандидаты, из которых выбирается ближайшее по расстоянию правки
+и самое частое.
+
+Словарь хранится в BLOG_INDEX_DIR/spelling/base-<версия>/: words.json – слова
+и частоты, hashes.bin и words.bin – отсортированные 64-битные хеши вариантов
+удаления и номера слов. Файлы отображаются в память при первом обращении.
+Строится командой build_spelling_index.
+"""
+import hashlib
+import os
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from taggit.models import Tag
+from ..index_storage import (IndexLock, atomic_write, index_dir, map_file, read_json,
+                             switch_version, write_json)
+from ..models import Post
+from .base import TERM_RE
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+
+
+def words(text):
+    return [word for word in TERM_RE.findall(text.casefold())
+            if len(word) > 2 and word.isalpha()]
+
+
+def deletes(word, distance=MAX_DISTANCE):
+    """
+    Все варианты слова с удалением до distance символов (включая само
+    слово); учитываются только первые PREFIX_LENGTH символов."""
+    variants = {word[:PREFIX_LENGTH]}
+    edge = set(variants)
+    for _ in range(distance):
+        edge = {variant[:i] + variant[i + 1:]
+                for variant in edge if len(variant) > 1
+                for i in range(len(variant))}
+        variants |= edge
+    return variants
+
+
+def key(variant):
+    return int.from_bytes(hashlib.blake2b(variant.encode(), digest_size=8).digest(), 'little')
+
+
+def edit_distance(a, b, limit=MAX_DISTANCE):
+    # Расстояние Дамерау – Левенштейна (с перестановкой соседних символов)
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SpellingIndex:
+    def __init__(self, directory, current):
+        self.current = current
+        base = directory / current['base']
+        data = read_json(base / 'words.json', {'words': [], 'counts': []})
+        self.words = data['words']
+        self.counts = data['counts']
+        self.vocabulary = set(self.words)
+        self.hashes = map_file(base / 'hashes.bin').cast('Q')
+        self.word_ids = map_file(base / 'words.bin').cast('I')
+
+    def correct(self, word):
+        """
+        Ближайшее к word слово словаря или None, если слово уже есть
+        в словаре или похожих нет."""
+        if word in self.vocabulary or len(word) < 3:
+            return None
+        best = None
+        seen = set()
+        for variant in deletes(word):
+            variant_key = key(variant)
+            position = bisect_left(self.hashes, variant_key)
+            while position < len(self.hashes) and self.hashes[position] == variant_key:
+                word_id = self.word_ids[position]
+                position += 1
+                if word_id in seen:
+                    continue
+                seen.add(word_id)
+                candidate = self.words[word_id]
+                distance = edit_distance(word, candidate)
+                if distance <= MAX_DISTANCE:
+                    rank = (distance, -self.counts[word_id])
+                    if best is None or rank < best[0]:
+                        best = (rank, candidate)
+        return best[1] if best else None
+
+    def suggest(self, query):
+        terms = TERM_RE.findall(query.casefold())
+        corrected = [self.correct(term) or term for term in terms]
+        if corrected == terms:
+            return None
+        return ' '.join(corrected)
+
+
+_loaded = {}
+
+
+def get_index():
+    directory = index_dir('spelling')
+    current = read_json(directory / 'CURRENT')
+    if current is None:
+        return None
+    index = _loaded.get(directory)
+    if index is None or index.current != current:
+        index = _loaded[directory] = SpellingIndex(directory, current)
+    return index
+
+
+def suggest(query):
+    """
+    Исправленный запрос или None. Если словарь еще не построен, подсказок нет."""
+    index = get_index()
+    return index.suggest(query) if index is not None else None
+
+
+def build_index():
+    """
+    Строит словарь по опубликованным постам и тегам. Возвращает число слов."""
+    counts = Counter()
+    posts = Post.published.values_list('title', 'body')
+    for title, body in posts.iterator(chunk_size=500):
+        counts.update(words(title))
+        counts.update(words(body))
+    for name in Tag.objects.values_list('name', flat=True):
+        counts.update(words(name))
+    vocabulary = sorted(counts)
+    pairs = sorted((key(variant), word_id)
+                   for word_id, word in enumerate(vocabulary)
+                   for variant in deletes(word))
+    directory = index_dir('spelling')
+    name = f'base-{time.time_ns():x}'
+    tmp = directory / f'.{name}'
+    tmp.mkdir()
+    write_json(tmp / 'words.json', {'words': vocabulary,
+                                    'counts': [counts[word] for word in vocabulary]})
+    atomic_write(tmp / 'hashes.bin', array('Q', [pair[0] for pair in pairs]).tobytes())
+    atomic_write(tmp / 'words.bin', array('I', [pair[1] for pair in pairs]).tobytes())
+    os.replace(tmp, directory / name)
+    with IndexLock(directory):
+        switch_version(directory, {'base': name})
+    _loaded.pop(directory, None)
+    return len(vocabulary)
@@ -0,0 +1,52 @@
+from django.db import connection
+from ..models import Post
+from .base import SNIPPET_WORDS, START, STOP, TERM_RE, SearchBackend
+
+
+def match_expression(query):
+    """
+    Запрос FTS5: все слова запроса как префиксы. Каждое слово берется
+    в кавычки, поэтому операторы FTS5 в тексте запроса не действуют."""
+    return ' '.join(f'"{term}"*' for term in TERM_RE.findall(query))
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    Поиск по виртуальной таблице FTS5 blog_post_fts (title, body) с внешним
+    содержимым в blog_post. Таблица синхронизируется триггерами на
+    blog_post (миграция 0011), результаты ранжируются функцией bm25()
+    с большим весом заголовка."""
+
+    def search(self, query, limit=None):
+        expression = match_expression(query)
+        if not expression:
+            return []
+        sql = ('SELECT blog_post.id FROM blog_post_fts '
+               'JOIN blog_post ON blog_post.id = blog_post_fts.rowid '
+               'WHERE blog_post_fts MATCH %s AND blog_post.status = %s '
+               'ORDER BY bm25(blog_post_fts, 10.0, 4.0), blog_post.publish DESC')
+        params = [expression, Post.Status.PUBLISHED]
+        if limit is not None:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def snippets(self, post_ids, query):
+        expression = match_expression(query)
+        if not expression or not post_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(post_ids))
+        with connection.cursor() as cursor:
+            # Фрагмент столбца body (номер 1) вокруг найденных слов
+            cursor.execute(f"SELECT rowid, snippet(blog_post_fts, 1, %s, %s, '…', %s) "
+                           f"FROM blog_post_fts WHERE blog_post_fts MATCH %s "
+                           f"AND rowid IN ({placeholders})",
+                           [START, STOP, SNIPPET_WORDS, expression, *post_ids])
+            return dict(cursor.fetchall())
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO blog_post_fts(blog_post_fts) VALUES ('rebuild')")
+        return Post.objects.count()
@@ -0,0 +1,206 @@
+"""
+Обработчики сигналов блога. Подключаются в BlogConfig.ready().
+"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from taggit.models import Tag, TaggedItem
+from .caching import bump_stamps, invalidate_lists, invalidate_pages, invalidate_sidebar
+from .models import Comment, Post
+from .search import autocomplete, bump_generation, get_backend
+from .similarity import neighbourhood, update_similar_posts
+from . import tfidf
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def reset_sidebar(sender, **kwargs):
+    # Боковая панель показывает число постов, последние и самые
+    # комментируемые посты, поэтому зависит от обеих моделей
+    invalidate_sidebar()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_change_stamp(sender, **kwargs):
+    # Метки изменений для условного GET (caching.conditional_page)
+    bump_stamps({Post: 'posts', Comment: 'comments', Tag: 'tags'}[sender])
+
+
+def was_or_is_published(instance):
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    return Post.Status.PUBLISHED in (instance.status, loaded.get('status'))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def reset_post_pages(sender, instance, **kwargs):
+    # Страница поста по текущему и по прежнему адресу (если изменились
+    # слаг или дата публикации), а также все списки постов и ленты, если
+    # пост опубликован или был опубликован
+    paths = {instance.get_absolute_url()}
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if 'publish' in loaded and 'slug' in loaded:
+        paths.add(Post(publish=loaded['publish'], slug=loaded['slug']).get_absolute_url())
+    invalidate_pages(paths)
+    if was_or_is_published(instance):
+        invalidate_lists()
+
+
+@receiver(post_save, sender=Post)
+def reset_referring_post_pages(sender, instance, created, **kwargs):
+    # Заголовок и адрес поста выводятся в блоке «Similar posts» постов,
+    # для которых он схожий. Смену статуса и даты публикации обрабатывает
+    # пересчет схожих постов (update_similar_posts_on_publish)
+    if not created and instance.has_changed('title', 'slug'):
+        Post.objects.filter(similar_links__similar=instance).invalidate_pages()
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def reset_comment_post_page(sender, instance, **kwargs):
+    post_ids = {instance.post_id}
+    state = instance.counter_state()
+    if state is not None:
+        post_ids.add(state[0])
+    Post.objects.filter(pk__in=post_ids).invalidate_pages()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def reset_tagged_post_pages(sender, instance, **kwargs):
+    # Имя тега выводится на страницах всех постов с этим тегом
+    Post.objects.filter(pk__in=TaggedItem.objects.filter(tag=instance)
+                        .values('object_id')).invalidate_pages()
+    invalidate_lists()
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def reset_pages_on_tags(sender, instance, action, **kwargs):
+    if isinstance(instance, Post) and action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_pages([instance.get_absolute_url()])
+        invalidate_lists()
+        bump_stamps('tags')
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_counter(sender, instance, created, **kwargs):
+    before = None if created else instance.counter_state()
+    after = (instance.post_id, instance.active)
+    if before != after:
+        if before is not None and before[1]:
+            Post.objects.filter(pk=before[0]).add_active_comments(-1)
+        if after[1]:
+            Post.objects.filter(pk=after[0]).add_active_comments(1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_counter(sender, instance, **kwargs):
+    state = instance.counter_state() or (instance.post_id, instance.active)
+    if state[1]:
+        Post.objects.filter(pk=state[0]).add_active_comments(-1)
+
+
+def schedule_similar_posts_update(post_ids):
+    # Пересчет выполняется после фиксации транзакции, когда теги уже сохранены
+    post_ids = set(post_ids)
+
+    def update():
+        update_similar_posts(post_ids)
+        # Блок «Similar posts» входит в кешированные страницы постов
+        Post.objects.filter(pk__in=post_ids).invalidate_pages()
+        bump_stamps('tags')
+
+    transaction.on_commit(update)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_similar_posts_on_tags(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Post):
+        return
+    if action == 'pre_clear':
+        instance._cleared_tag_ids = set(instance.tags.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        tag_ids = pk_set if action != 'post_clear' \
+            else getattr(instance, '_cleared_tag_ids', set())
+        schedule_similar_posts_update(neighbourhood([instance.pk], tag_ids))
+
+
+@receiver(post_save, sender=Post)
+def update_similar_posts_on_publish(sender, instance, created, **kwargs):
+    # Публикация, снятие с публикации и смена даты меняют списки соседей
+    if not created and instance.has_changed('status', 'publish'):
+        schedule_similar_posts_update(neighbourhood([instance.pk]))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_similar_posts_neighbourhood(sender, instance, **kwargs):
+    instance._similar_neighbourhood = neighbourhood([instance.pk])
+
+
+@receiver(post_delete, sender=Post)
+def update_similar_posts_on_delete(sender, instance, **kwargs):
+    schedule_similar_posts_update(getattr(instance, '_similar_neighbourhood', ()))
+
+
+@receiver(post_save, sender=Post)
+def update_tfidf_index(sender, instance, **kwargs):
+    if instance.has_changed('title', 'body', 'status'):
+        post_id = instance.pk
+        transaction.on_commit(lambda: tfidf.update_posts([post_id]))
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_tfidf_index(sender, instance, **kwargs):
+    post_id = instance.pk
+    transaction.on_commit(lambda: tfidf.update_posts([post_id]))
+
+
+def schedule_search_update(post_id):
+    # Индексы PostgreSQL и FTS5 обновляет сама СУБД, встроенному индексу
+    # (blog/search/inverted.py) изменения передаются после фиксации. Поколение
+    # кеша результатов увеличивается после обновления индекса, чтобы
+    # в новое поколение не попали прежние результаты
+    def update():
+        get_backend().update_posts([post_id])
+        bump_generation()
+
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, **kwargs):
+    if instance.has_changed('title', 'body', 'status', 'publish') \
+            and was_or_is_published(instance):
+        schedule_search_update(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_search_index(sender, instance, **kwargs):
+    if was_or_is_published(instance):
+        schedule_search_update(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def update_autocomplete_post(sender, instance, **kwargs):
+    if instance.has_changed('title', 'slug', 'publish', 'status'):
+        transaction.on_commit(lambda: autocomplete.update_post(instance))
+
+
+@receiver(post_save, sender=Tag)
+def update_autocomplete_tag(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autocomplete.update_tag(instance))
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Tag)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    kind = 'post' if sender is Post else 'tag'
+    object_id = instance.pk
+    transaction.on_commit(lambda: autocomplete.remove(kind, object_id))
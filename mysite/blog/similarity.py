@@ -0,0 +1,174 @@
+"""
+Предварительный расчет схожих постов по общим тегам.
+Для каждого опубликованного поста в таблице SimilarPost хранятся k постов
+с наибольшим числом общих тегов (при равенстве – более поздние). Расчет
+выполняется векторно в NumPy по разреженной матрице инцидентности
+«пост – тег», хранящейся в виде массивов CSR/CSC (indptr + indices).
+Команда build_similar_posts пересчитывает всю таблицу, а сигналы
+(blog/signals.py) – только окрестность поста, у которого изменились теги.
+"""
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from taggit.models import TaggedItem
+from .models import Post, SimilarPost
+
+
+def similar_posts_count():
+    return getattr(settings, 'BLOG_SIMILAR_POSTS', 4)
+
+
+def concat_ranges(starts, lengths):
+    # Индексы, объединяющие срезы [start, start + length) без цикла Python
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + np.arange(total) - offsets
+
+
+class TagIncidence:
+    """
+    Матрица инцидентности опубликованных постов и тегов в двух
+    сжатых представлениях: по строкам (пост -> теги) и по столбцам
+    (тег -> посты)."""
+
+    def __init__(self, pairs, publish):
+        self.post_ids = np.array(sorted(publish), dtype=np.int64)
+        # Ключ для упорядочивания равных по числу общих тегов постов
+        self.publish = np.array([publish[post_id].timestamp()
+                                 for post_id in self.post_ids.tolist()])
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        rows = np.searchsorted(self.post_ids, pairs[:, 0])
+        tag_ids, cols = np.unique(pairs[:, 1], return_inverse=True)
+        self.tag_ids = tag_ids
+        size = len(self.post_ids)
+
+        order = np.lexsort((cols, rows))
+        self.post_tags = cols[order]
+        self.post_indptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(rows, minlength=size))))
+
+        order = np.lexsort((rows, cols))
+        self.tag_posts = rows[order]
+        self.tag_indptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(cols, minlength=len(tag_ids)))))
+
+    @classmethod
+    def load(cls, tag_ids=None):
+        """
+        Загружает инцидентность опубликованных постов. Если передан tag_ids,
+        загружаются только эти теги: этого достаточно, чтобы посчитать общие
+        теги для постов, у которых все теги входят в tag_ids."""
+        published = Post.published.all()
+        items = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Post),
+            object_id__in=published.values('id'))
+        if tag_ids is not None:
+            items = items.filter(tag_id__in=list(tag_ids))
+        pairs = list(items.values_list('object_id', 'tag_id'))
+        post_ids = {post_id for post_id, _ in pairs}
+        if tag_ids is None:
+            publish = dict(published.values_list('id', 'publish'))
+        else:
+            publish = dict(published.filter(id__in=post_ids)
+                           .values_list('id', 'publish'))
+        return cls(pairs, publish)
+
+    def top_k(self, post_ids, k):
+        """
+        Для постов post_ids возвращает массивы (пост, схожий пост, число
+        общих тегов, ранг) с не более чем k схожими постами на пост."""
+        empty = (np.zeros(0, dtype=np.int64),) * 4
+        post_ids = np.asarray(post_ids, dtype=np.int64)
+        if not len(self.post_ids) or not len(post_ids):
+            return empty
+        # Позиции запрошенных постов; неопубликованные и посты без тегов пропускаются
+        queries = np.minimum(np.searchsorted(self.post_ids, post_ids),
+                             len(self.post_ids) - 1)
+        queries = queries[self.post_ids[queries] == post_ids]
+        # Пары (запрос, тег), затем пары (запрос, пост с тем же тегом)
+        degrees = np.diff(self.post_indptr)[queries]
+        query_tags = self.post_tags[concat_ranges(self.post_indptr[queries], degrees)]
+        query_rows = np.repeat(queries, degrees)
+        tag_sizes = np.diff(self.tag_indptr)[query_tags]
+        candidates = self.tag_posts[concat_ranges(self.tag_indptr[query_tags], tag_sizes)]
+        query_rows = np.repeat(query_rows, tag_sizes)
+        mask = candidates != query_rows
+        query_rows, candidates = query_rows[mask], candidates[mask]
+        if not len(candidates):
+            return empty
+        # Число общих тегов – число повторений пары (запрос, кандидат)
+        size = len(self.post_ids)
+        keys, shared = np.unique(query_rows * size + candidates, return_counts=True)
+        query_rows, candidates = keys // size, keys % size
+        order = np.lexsort((-self.post_ids[candidates],
+                            -self.publish[candidates],
+                            -shared,
+                            query_rows))
+        query_rows, candidates, shared = query_rows[order], candidates[order], shared[order]
+        # Порядковый номер кандидата внутри группы одного запроса
+        group_start = np.flatnonzero(np.r_[True, query_rows[1:] != query_rows[:-1]])
+        group_sizes = np.diff(np.r_[group_start, len(query_rows)])
+        ranks = np.arange(len(query_rows)) - np.repeat(group_start, group_sizes)
+        keep = ranks < k
+        return (self.post_ids[query_rows[keep]], self.post_ids[candidates[keep]],
+                shared[keep], ranks[keep])
+
+
+def _store(post_ids, result):
+    rows = [SimilarPost(post_id=post_id, similar_id=similar_id,
+                        shared_tags=shared, rank=rank)
+            for post_id, similar_id, shared, rank in zip(*(column.tolist()
+                                                           for column in result))]
+    with transaction.atomic():
+        SimilarPost.objects.filter(post_id__in=post_ids).delete()
+        SimilarPost.objects.bulk_create(rows)
+    return len(rows)
+
+
+def build_similar_posts(batch_size=1000, k=None):
+    """
+    Полный пересчет таблицы схожих постов. Возвращает число записей."""
+    k = k or similar_posts_count()
+    incidence = TagIncidence.load()
+    SimilarPost.objects.exclude(post__status=Post.Status.PUBLISHED).delete()
+    total = 0
+    for start in range(0, len(incidence.post_ids), batch_size):
+        batch = incidence.post_ids[start:start + batch_size]
+        total += _store(batch.tolist(), incidence.top_k(batch, k))
+    return total
+
+
+def neighbourhood(post_ids, tag_ids=None):
+    """
+    Посты, чьи списки схожих постов могут измениться при изменении тегов
+    постов post_ids: сами посты и все посты с их тегами. tag_ids дополняет
+    текущие теги (например, только что удаленными)."""
+    content_type = ContentType.objects.get_for_model(Post)
+    tags = set(tag_ids or ())
+    tags.update(TaggedItem.objects.filter(content_type=content_type,
+                                          object_id__in=post_ids)
+                .values_list('tag_id', flat=True))
+    affected = set(post_ids)
+    affected.update(TaggedItem.objects.filter(content_type=content_type,
+                                              tag_id__in=tags)
+                    .values_list('object_id', flat=True))
+    return affected
+
+
+def update_similar_posts(post_ids, k=None):
+    """
+    Пересчитывает схожие посты только для постов post_ids. Загружается
+    лишь та часть матрицы инцидентности, что относится к их тегам."""
+    k = k or similar_posts_count()
+    post_ids = sorted(set(post_ids))
+    if not post_ids:
+        return 0
+    content_type = ContentType.objects.get_for_model(Post)
+    tag_ids = set(TaggedItem.objects.filter(content_type=content_type,
+                                            object_id__in=post_ids)
+                  .values_list('tag_id', flat=True))
+    incidence = TagIncidence.load(tag_ids)
+    return _store(post_ids, incidence.top_k(post_ids, k))
@@ -8,17 +8,194 @@ Sitemap модуля sitemaps. Атрибуты changefreq и priority указ
 url() по каждому объекту, чтобы получить его URL-адрес.
 Метод lastmod получает каждый возвращаемый методом items() объект
 и возвращает время последнего изменения объекта.
+
+Карта сайта разбита на разделы по BLOG_SITEMAP_SECTION_SIZE адресов:
+sitemap.xml – индекс разделов, sitemap-<раздел>.xml?p=<номер> – сами
+разделы: посты, страницы тегов и помесячного архива. Раздел читает
+из БД только столбцы адреса и даты изменения (values_list) порциями через
+iterator() и отдается потоком, поэтому расход памяти не зависит от числа постов. Готовый XML каждого раздела
+кешируется до изменения списков постов (caching.invalidate_lists).
+Дата изменения страницы тега или месяца – MAX(updated) ее постов,
+вычисляемый для всего раздела одним запросом с группировкой.
 """
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps.views import x_robots_tag
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .caching import list_generation
+from django.db.models import Max
+from django.db.models.functions import TruncMonth
 from .models import Post
 
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XML_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+# Число строк, читаемых из БД и отдаваемых клиенту за раз
+CHUNK_SIZE = 1000
+
+
+class BlogSitemap(Sitemap):
+    """
+    Раздел карты сайта. items() возвращает values_list с нужными
+    столбцами, location() и lastmod() строят адрес и дату по строке."""
+
+    @property
+    def limit(self):
+        return getattr(settings, 'BLOG_SITEMAP_SECTION_SIZE', 5000)
 
-class PostSitemap(Sitemap):
+    @cached_property
+    def prefix(self):
+        # Адреса строятся по шаблонам URL блога без reverse() для каждой
+        # строки, например /blog/<год>/<месяц>/<день>/<слаг>/ для поста
+        return reverse('blog:post_list')
+
+
+class PostSitemap(BlogSitemap):
     changefreq = 'weekly'
     priority = 0.9
 
     def items(self):
-        return Post.published.all()
+        return Post.published.order_by('id').values_list(
+            'id', 'slug', 'publish', 'updated', named=True)
+
+    def location(self, item):
+        publish = timezone.localtime(item.publish)
+        return f'{self.prefix}{publish.year}/{publish.month}/{publish.day}/{item.slug}/'
+
+    def lastmod(self, item):
+        return item.updated
+
+
+class TagSitemap(BlogSitemap):
+    changefreq = 'daily'
+    priority = 0.6
+
+    def items(self):
+        # Теги опубликованных постов и время последнего изменения их постов
+        return Post.published.filter(tags__isnull=False).values('tags__slug') \
+            .annotate(lastmod=Max('updated')).order_by('tags__slug') \
+            .values_list('tags__slug', 'lastmod', named=True)
+
+    def location(self, item):
+        return f'{self.prefix}tag/{item.tags__slug}/'
+
+    def lastmod(self, item):
+        return item.lastmod
+
+
+class ArchiveSitemap(BlogSitemap):
+    changefreq = 'monthly'
+    priority = 0.5
+
+    def items(self):
+        return Post.published.annotate(month=TruncMonth('publish')).values('month') \
+            .annotate(lastmod=Max('updated')).order_by('month') \
+            .values_list('month', 'lastmod', named=True)
+
+    def location(self, item):
+        return f'{self.prefix}archive/{item.month.year}/{item.month.month}/'
+
+    def lastmod(self, item):
+        return item.lastmod
+
+
+def _w3c_date(value):
+    if isinstance(value, datetime):
+        value = timezone.localtime(value).date()
+    return value.isoformat()
+
+
+def _cached_xml(key, render):
+    """
+    Отдает XML из кеша, а при его отсутствии – потоком из генератора
+    render() и сохраняет в кеш полностью отданный ответ."""
+    content = cache.get(key)
+    if content is not None:
+        return HttpResponse(content, content_type='application/xml')
+    chunks = render()
+
+    def stream():
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        cache.set(key, ''.join(parts), getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 600))
+
+    return StreamingHttpResponse(stream(), content_type='application/xml')
+
+
+def _cache_key(request, *parts):
+    # XML содержит абсолютные адреса, поэтому схема и домен входят в ключ
+    return ':'.join(['blog:sitemap', str(list_generation()), _base_url(request),
+                     *map(str, parts)])
+
+
+def _base_url(request):
+    return f'{request.scheme}://{get_current_site(request).domain}'
+
+
+def _index_xml(sitemaps, base):
+    yield f'{XML_HEADER}<sitemapindex xmlns="{XML_NAMESPACE}">\n'
+    for section, site in sitemaps.items():
+        location = escape(base + reverse('sitemap_section', kwargs={'section': section}))
+        for number in site().paginator.page_range:
+            suffix = f'?p={number}' if number > 1 else ''
+            yield f'<sitemap><loc>{location}{suffix}</loc></sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def _urlset_xml(site, page, base):
+    yield f'{XML_HEADER}<urlset xmlns="{XML_NAMESPACE}">\n'
+    lines = []
+    for item in page.object_list.iterator(chunk_size=CHUNK_SIZE):
+        line = f'<url><loc>{escape(base + site.location(item))}</loc>'
+        lastmod = site.lastmod(item)
+        if lastmod:
+            line += f'<lastmod>{_w3c_date(lastmod)}</lastmod>'
+        if site.changefreq:
+            line += f'<changefreq>{site.changefreq}</changefreq>'
+        if site.priority:
+            line += f'<priority>{site.priority}</priority>'
+        lines.append(line + '</url>\n')
+        if len(lines) == CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    lines.append('</urlset>\n')
+    yield ''.join(lines)
+
+
+@x_robots_tag
+def index(request, sitemaps):
+    """
+    Индекс карты сайта: адрес каждой страницы каждого раздела."""
+    return _cached_xml(_cache_key(request, 'index'),
+                       lambda: _index_xml(sitemaps, _base_url(request)))
+
+
+@x_robots_tag
+def section(request, sitemaps, section):
+    if section not in sitemaps:
+        raise Http404(f'No sitemap available for section: {section!r}')
+    # Номер страницы приводится к int, чтобы ?p=01 и ?p=1 были одной записью кеша
+    try:
+        number = int(request.GET.get('p', 1))
+    except ValueError:
+        raise Http404(f'No page {request.GET["p"]!r} in sitemap section {section!r}')
+
+    def render():
+        site = sitemaps[section]()
+        try:
+            page = site.paginator.page(number)
+        except InvalidPage:
+            raise Http404(f'No page {number!r} in sitemap section {section!r}')
+        return _urlset_xml(site, page, _base_url(request))
 
-    def lastmod(self, obj):
-        return obj.updated
+    return _cached_xml(_cache_key(request, section, number), render)
@@ -1,8 +1,7 @@
 from django import template
 from ..models import Post
-from django.db.models import Count
 from django.utils.safestring import mark_safe
-import markdown
+from ..rendering import render_markdown
 
 register = template.Library()
 
@@ -19,7 +18,7 @@ def total_posts():
 
 @register.inclusion_tag('blog/post/latest_posts.html')
 def show_latest_posts(count=5):
-    latest_posts = Post.published.order_by('-publish')[:count]
+    latest_posts = Post.published.for_listing().order_by('-publish')[:count]
     return {'latest_posts': latest_posts}
 
 
@@ -37,9 +36,9 @@ count].
 
 @register.simple_tag
 def get_most_commented_posts(count=5):
-    return Post.published.annotate(
-        total_comments=Count('comments')
-    ).order_by('-total_comments')[:count]
+    # Счетчик active_comments хранится в модели Post, поэтому выборка
+    # идет по индексу (status, -active_comments) без соединения с комментариями
+    return Post.published.for_listing().order_by('-active_comments')[:count]
 
 
 """
@@ -53,5 +52,14 @@ def get_most_commented_posts(count=5):
 
 
 @register.filter(name='markdown')
-def markdown_format(text):
-    return mark_safe(markdown.markdown(text))
+def markdown_format(value):
+    # Для постов используется сохраненный HTML, прорисованный при сохранении
+    if isinstance(value, Post):
+        return mark_safe(value.get_body_html())
+    return mark_safe(render_markdown(value))
+
+
+@register.filter
+def excerpt(post, words):
+    # Сохраненный отрывок поста вместо post.body|markdown|truncatewords_html
+    return mark_safe(post.get_excerpt(words))
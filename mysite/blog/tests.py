@@ -1,3 +1,1148 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import re
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from taggit.models import Tag
+from . import comment_queue, tfidf
+from .caching import LIST_GENERATION_KEY, invalidate_lists
+from .index_storage import IndexLock, index_dir, read_json
+from .models import Post, Comment, SimilarPost
+from .rendering import content_hash, render_excerpts, render_markdown, renderer_version
+from .pagination import NEXT, PREVIOUS, CursorPaginator, InvalidCursor
+from .similarity import TagIncidence, build_similar_posts, neighbourhood
+from .search import GENERATION_KEY, search_stats
+from .search import spelling
+from .search import inverted
+from .search.inverted import build_index
 
-# Create your tests here.
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+# Комментарии сохраняются сразу; очередь проверяется в CommentQueueTests
+@override_settings(CACHES=LOCMEM_CACHES, BLOG_COMMENT_QUEUE=None)
+class BlogTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='secret')
+        cls.posts = []
+        for i in range(5):
+            post = Post.objects.create(title=f'Post {i}',
+                                       slug=f'post-{i}',
+                                       author=cls.author,
+                                       body=f'Body of post {i}. ' * 20,
+                                       status=Post.Status.PUBLISHED)
+            post.tags.add('common', f'tag-{i}')
+            for j in range(i):
+                Comment.objects.create(post=post, name=f'Reader {j}',
+                                       email='reader@example.com',
+                                       body='Nice post')
+            cls.posts.append(post)
+
+    def setUp(self):
+        cache.clear()
+        Site.objects.clear_cache()
+
+    def use_temporary_index_dir(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(BLOG_INDEX_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def explain(self, sql):
+        # План выполнения запроса в виде строки для SQLite и PostgreSQL
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            return '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+
+
+# Без полностраничного кеша: запись с временем жизни 0 сразу устаревает
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class SidebarCacheTests(BlogTestCase):
+    def test_sidebar_queries_are_cached(self):
+        # Бенчмарк: первый запрос выполняет N + 3 запроса к БД,
+        # последующие — только N запросов самого представления
+        url = self.posts[0].get_absolute_url()
+        cold = self.count_queries(url)
+        warm = self.count_queries(url)
+        self.assertEqual(cold - warm, 3)
+
+    def test_sidebar_is_shared_between_pages(self):
+        self.count_queries(self.posts[0].get_absolute_url())
+        cold = self.count_queries(self.posts[1].get_absolute_url())
+        cache.clear()
+        self.assertEqual(self.count_queries(self.posts[1].get_absolute_url()),
+                         cold + 3)
+
+    def test_sidebar_invalidated_by_post_and_comment_changes(self):
+        url = self.posts[0].get_absolute_url()
+        self.count_queries(url)
+        warm = self.count_queries(url)
+        Comment.objects.create(post=self.posts[0], name='Reader',
+                               email='reader@example.com', body='Hi')
+        self.assertEqual(self.count_queries(url), warm + 3)
+        self.posts[4].delete()
+        response = self.client.get(url)
+        self.assertContains(response, "I've written 4 posts so far.")
+
+
+class PageCacheTests(BlogTestCase):
+    def test_anonymous_pages_are_cached(self):
+        for url in ('/blog/', '/blog/tag/common/', self.posts[0].get_absolute_url()):
+            self.count_queries(url)
+            self.assertEqual(self.count_queries(url), 0)
+
+    def test_cached_page_gets_visitor_csrf_token(self):
+        url = self.posts[0].get_absolute_url()
+        self.client.get(url)
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(url)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"',
+                          response.content.decode()).group(1)
+        response = client.post(f'/blog/{self.posts[0].id}/comment/',
+                               {'csrfmiddlewaretoken': token, 'name': 'Reader',
+                                'email': 'reader@example.com', 'body': 'Hi'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_page_gets_current_sidebar(self):
+        url = self.posts[0].get_absolute_url()
+        self.client.get(url)
+        Post.objects.create(title='New post', slug='new-post', author=self.author,
+                            body='Body', status=Post.Status.PUBLISHED)
+        # Страница поста осталась в кеше, заново строится только боковая панель
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, "I've written 6 posts so far.")
+
+    def test_gzip_response(self):
+        url = self.posts[0].get_absolute_url()
+        plain = self.client.get(url).content
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        # Страницы совпадают с точностью до токена CSRF
+        token = rb'value="[^"]+"'
+        self.assertEqual(re.sub(token, b'', gzip.decompress(response.content)),
+                         re.sub(token, b'', plain))
+
+    def test_pages_invalidated_by_changes(self):
+        post = self.posts[4]
+        for url in ('/blog/', post.get_absolute_url()):
+            self.client.get(url)
+        Comment.objects.create(post=post, name='Reader',
+                               email='reader@example.com', body='New comment')
+        self.assertContains(self.client.get(post.get_absolute_url()), 'New comment')
+        post.title = 'Renamed post'
+        post.save()
+        self.assertContains(self.client.get('/blog/'), 'Renamed post')
+        post.tags.add('fresh')
+        self.assertContains(self.client.get('/blog/'), 'fresh')
+
+    def test_evicted_list_generation_does_not_revive_pages(self):
+        self.client.get('/blog/')
+        Post.objects.filter(id=self.posts[4].id).update(title='Renamed post')
+        # Номер поколения вытеснен из кеша раньше страниц списков
+        cache.delete(LIST_GENERATION_KEY)
+        invalidate_lists()
+        self.assertContains(self.client.get('/blog/'), 'Renamed post')
+
+    def test_similar_post_rename_resets_referring_pages(self):
+        build_similar_posts()
+        post, other = self.posts[0], self.posts[1]
+        self.assertIn(post.id, SimilarPost.objects.filter(post=other)
+                      .values_list('similar_id', flat=True))
+        url = other.get_absolute_url()
+        self.client.get(url)
+        post.title = 'Renamed post'
+        post.slug = 'renamed-post'
+        post.save()
+        # Только блок «Similar posts»: боковая панель подставляется заново всегда
+        similar = self.client.get(url).content.decode().split('<h2>Similar posts</h2>')[1]
+        similar = similar.split('<h2>')[0]
+        self.assertIn(f'<a href="{post.get_absolute_url()}">Renamed post</a>', similar)
+        self.assertNotIn('Post 0', similar)
+
+    def test_logged_in_users_bypass_cache(self):
+        url = self.posts[0].get_absolute_url()
+        self.client.get(url)
+        self.client.login(username='author', password='secret')
+        self.assertGreater(self.count_queries(url), 0)
+
+
+class ConditionalGetTests(BlogTestCase):
+    def assertNotModified(self, url):
+        # Первый ответ выдает cookie CSRF, которая входит в ETag страницы поста
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_not_modified(self):
+        for url in ('/blog/', '/blog/tag/common/', self.posts[0].get_absolute_url(),
+                    '/blog/feed/', '/sitemap.xml'):
+            self.assertNotModified(url)
+
+    def test_validators_change_with_data(self):
+        url = self.posts[0].get_absolute_url()
+        page = self.assertNotModified(url)
+        feed = self.assertNotModified('/blog/feed/')
+        Comment.objects.create(post=self.posts[1], name='Reader',
+                               email='reader@example.com', body='Hi')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=page).status_code, 200)
+        # Лента не зависит от комментариев
+        self.assertEqual(self.client.get('/blog/feed/', HTTP_IF_NONE_MATCH=feed).status_code, 304)
+        lists = self.assertNotModified('/blog/')
+        self.posts[0].tags.add('fresh')
+        self.assertEqual(self.client.get('/blog/', HTTP_IF_NONE_MATCH=lists).status_code, 200)
+
+
+class FeedTests(BlogTestCase):
+    def test_tag_feeds(self):
+        response = self.client.get('/blog/tag/common/feed/')
+        self.assertContains(response, 'posts tagged with "common"')
+        self.assertContains(response, '<category>common</category>')
+        response = self.client.get('/blog/tag/common/feed/atom/')
+        self.assertEqual(response['Content-Type'], 'application/atom+xml; charset=utf-8')
+        self.assertContains(response, '<category term="common"/>')
+        self.assertEqual(self.client.get('/blog/tag/missing/feed/').status_code, 404)
+
+    def test_atom_feed(self):
+        response = self.client.get('/blog/feed/atom/')
+        self.assertContains(response, '<subtitle>New posts of my blog.</subtitle>')
+        self.assertContains(response, self.posts[0].title)
+
+    def test_regenerated_only_for_published_posts(self):
+        self.client.get('/blog/feed/')
+        Post.objects.create(title='Draft', slug='draft', author=self.author,
+                            body='Draft body.', status=Post.Status.DRAFT)
+        with self.assertNumQueries(0):
+            self.client.get('/blog/feed/')
+        self.posts[0].title = 'Renamed post'
+        self.posts[0].save()
+        self.assertContains(self.client.get('/blog/feed/'), 'Renamed post')
+
+
+class MonthArchiveTests(BlogTestCase):
+    def test_lists_posts_of_the_month(self):
+        Post.objects.filter(pk=self.posts[0].pk).update(
+            publish=self.posts[0].publish - timedelta(days=40))
+        publish = self.posts[1].publish
+        response = self.client.get(f'/blog/archive/{publish.year}/{publish.month}/')
+        self.assertContains(response, 'Posts published in')
+        self.assertEqual([post.id for post in response.context['posts']],
+                         [post.id for post in self.posts[:0:-1][:3]])
+        self.assertEqual(self.client.get('/blog/archive/2024/13/').status_code, 404)
+
+    def test_months_outside_datetime_range(self):
+        for url in ('/blog/archive/9999/12/', '/blog/archive/99999999999999999999/1/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(BLOG_SITEMAP_SECTION_SIZE=2)
+class SitemapTests(BlogTestCase):
+    def get_xml(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response) if response.streaming else response.content
+
+    def test_sections_list_every_published_post(self):
+        index = self.get_xml('/sitemap.xml').decode()
+        sections = re.findall(r'<loc>http://example.com(/sitemap-posts[^<]+)</loc>', index)
+        self.assertEqual(sections, ['/sitemap-posts.xml', '/sitemap-posts.xml?p=2',
+                                    '/sitemap-posts.xml?p=3'])
+        locations = []
+        for url in sections:
+            locations += re.findall(r'<loc>http://example.com([^<]+)</loc>',
+                                    self.get_xml(url).decode())
+        self.assertEqual(locations, [post.get_absolute_url() for post in self.posts])
+        self.assertEqual(self.client.get('/sitemap-posts.xml?p=4').status_code, 404)
+        self.assertEqual(self.client.get('/sitemap-missing.xml').status_code, 404)
+
+    def test_loads_only_url_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_xml('/sitemap-posts.xml')
+        self.assertNotIn('"body"', queries[-1]['sql'])
+
+    def test_tag_and_archive_sections(self):
+        Post.objects.filter(pk=self.posts[3].pk).update(
+            updated=timezone.now() + timedelta(days=3))
+        self.get_xml('/sitemap.xml')
+        # Подсчет строк раздела и один запрос с группировкой
+        with self.assertNumQueries(2):
+            xml = self.get_xml('/sitemap-tags.xml?p=3').decode()
+        lastmod = (timezone.now() + timedelta(days=3)).date().isoformat()
+        self.assertIn(f'<loc>http://example.com/blog/tag/tag-3/</loc><lastmod>{lastmod}</lastmod>', xml)
+        xml = self.get_xml('/sitemap-archive.xml').decode()
+        month = self.posts[0].publish
+        url = f'/blog/archive/{month.year}/{month.month}/'
+        self.assertIn(f'<loc>http://example.com{url}</loc><lastmod>{lastmod}</lastmod>', xml)
+        self.assertContains(self.client.get(url), self.posts[0].title)
+
+    def test_sections_are_cached(self):
+        xml = self.get_xml('/sitemap-posts.xml?p=2')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_xml('/sitemap-posts.xml?p=2'), xml)
+        self.posts[2].title = 'Renamed post'
+        self.posts[2].save()
+        with self.assertNumQueries(2):
+            self.get_xml('/sitemap-posts.xml?p=2')
+
+    def test_cache_key_includes_scheme_and_normalized_page(self):
+        self.get_xml('/sitemap.xml')
+        response = self.client.get('/sitemap.xml', secure=True)
+        xml = b''.join(response) if response.streaming else response.content
+        self.assertIn(b'<loc>https://example.com/sitemap-posts.xml</loc>', xml)
+        self.assertNotIn(b'http://example.com', xml)
+        xml = self.get_xml('/sitemap-posts.xml?p=2')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_xml('/sitemap-posts.xml?p=02'), xml)
+        self.assertEqual(self.client.get('/sitemap-posts.xml?p=x').status_code, 404)
+
+
+class RenderingTests(BlogTestCase):
+    def test_body_is_rendered_on_save_only_when_changed(self):
+        post = self.posts[0]
+        post.body = 'Line one\nline **two**'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p>Line one\nline <strong>two</strong></p>')
+        self.assertEqual(post.body_html_version, renderer_version())
+        self.assertFalse(post.render_body())
+        with mock.patch('blog.models.render_markdown') as render:
+            post.title = 'Renamed post'
+            post.save()
+        render.assert_not_called()
+
+    def test_renderer_change_is_applied_by_command(self):
+        post = self.posts[0]
+        post.body = 'Line one\nline two'
+        post.save()
+        url = post.get_absolute_url()
+        self.assertContains(self.client.get(url), 'Line one\nline two')
+        self.assertContains(self.client.get('/blog/feed/'), 'Line one\nline two')
+        version = renderer_version()
+        with self.settings(BLOG_MARKDOWN_EXTENSIONS=['nl2br']):
+            self.assertNotEqual(renderer_version(), version)
+            out = StringIO()
+            call_command('rerender_posts', stdout=out)
+            self.assertEqual(out.getvalue().strip(), 'Re-rendered 5 post(s).')
+            post.refresh_from_db()
+            self.assertEqual(post.body_html, '<p>Line one<br />\nline two</p>')
+            # Кешированные страница поста и лента сброшены
+            self.assertContains(self.client.get(url), 'Line one<br />')
+            self.assertContains(self.client.get('/blog/feed/'), 'Line one&lt;br /&gt;')
+            call_command('rerender_posts', stdout=out)
+            self.assertIn('Re-rendered 0 post(s).', out.getvalue())
+
+    def test_migration_backfills_body_html(self):
+        migration = import_module('blog.migrations.0013_backfill_body_html')
+        Post.objects.update(body_html='', body_hash='', body_html_version='')
+        migration.backfill_body_html(apps, None)
+        for post in Post.objects.all():
+            self.assertEqual(post.body_html, render_markdown(post.body))
+            self.assertEqual(post.body_hash, content_hash(post.body))
+            self.assertEqual(post.body_html_version, renderer_version())
+
+
+class ExcerptTests(BlogTestCase):
+    def test_list_uses_stored_excerpts(self):
+        post = self.posts[4]
+        self.assertEqual(set(post.excerpts), {'12', '30'})
+        with mock.patch('blog.models.render_markdown') as render, \
+                mock.patch('blog.models.truncatewords_html') as truncate, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/blog/')
+        render.assert_not_called()
+        truncate.assert_not_called()
+        # Тот же бюджет, что в QueryBudgetTests; тело и HTML постов не загружаются
+        self.assertEqual(len(queries), 5)
+        self.assertFalse([query for query in queries.captured_queries
+                          if '"blog_post"."body_html"' in query['sql']])
+        self.assertContains(response, post.excerpts['30'])
+
+    def test_migration_backfills_excerpts(self):
+        migration = import_module('blog.migrations.0014_backfill_excerpts')
+        Post.objects.update(excerpts={})
+        migration.backfill_excerpts(apps, None)
+        for post in Post.objects.all():
+            self.assertEqual(post.excerpts, render_excerpts(post.body_html))
+
+
+class CommentCounterTests(BlogTestCase):
+    def counters(self):
+        return list(Post.objects.order_by('id').values_list('active_comments', flat=True))
+
+    def assertCounters(self, expected):
+        self.assertEqual(self.counters(), expected)
+        # Счетчики совпадают с числом активных комментариев
+        self.assertEqual(expected, [post.comments.filter(active=True).count()
+                                    for post in Post.objects.order_by('id')])
+
+    def test_save_toggles_and_moves(self):
+        self.assertCounters([0, 1, 2, 3, 4])
+        comment = Comment.objects.filter(post=self.posts[2]).first()
+        comment.active = False
+        comment.save()
+        comment.save()
+        self.assertCounters([0, 1, 1, 3, 4])
+        comment.post = self.posts[0]
+        comment.save()
+        self.assertCounters([0, 1, 1, 3, 4])
+        comment.active = True
+        comment.save()
+        self.assertCounters([1, 1, 1, 3, 4])
+        # Перенос активного комментария меняет оба счетчика
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.post = self.posts[4]
+        comment.save()
+        self.assertCounters([0, 1, 1, 3, 5])
+
+    def test_delete(self):
+        inactive = Comment.objects.filter(post=self.posts[3]).first()
+        inactive.active = False
+        inactive.save()
+        inactive.delete()
+        Comment.objects.filter(post=self.posts[4]).first().delete()
+        self.assertCounters([0, 1, 2, 2, 3])
+        Comment.objects.filter(post__in=self.posts[1:3]).delete()
+        self.assertCounters([0, 0, 0, 2, 3])
+
+    def test_admin_actions(self):
+        User.objects.create_superuser('admin', password='secret')
+        self.client.login(username='admin', password='secret')
+        comments = Comment.objects.filter(post__in=self.posts[3:]).order_by('id')
+        selected = [comment.pk for comment in comments[:5]]
+
+        def run(action):
+            return self.client.post('/admin/blog/comment/',
+                                    {'action': action, '_selected_action': selected},
+                                    follow=True)
+
+        self.assertContains(run('deactivate_comments'), '5 comment(s) deactivated.')
+        self.assertCounters([0, 1, 2, 0, 2])
+        # Уже отключенные комментарии не учитываются повторно
+        self.assertContains(run('deactivate_comments'), '0 comment(s) deactivated.')
+        self.assertCounters([0, 1, 2, 0, 2])
+        self.assertContains(run('activate_comments'), '5 comment(s) activated.')
+        self.assertCounters([0, 1, 2, 3, 4])
+
+    def test_drifted_counter_does_not_go_below_zero(self):
+        post = self.posts[4]
+        Post.objects.filter(pk=post.pk).update(active_comments=1)
+        comments = list(Comment.objects.filter(post=post).order_by('id'))
+        comments[0].active = False
+        comments[0].save()
+        comments[1].delete()
+        Comment.objects.filter(pk__in=[comment.pk for comment in comments[2:]]).set_active(False)
+        self.assertEqual(Post.objects.get(pk=post.pk).active_comments, 0)
+
+    def test_recount_command(self):
+        Post.objects.update(active_comments=7)
+        Comment.objects.filter(post=self.posts[4]).update(active=False)
+        out = StringIO()
+        call_command('recount_comments', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Recounted comments for 5 post(s), fixed 5.')
+        self.assertCounters([0, 1, 2, 3, 0])
+
+    def test_recount_resets_cached_pages(self):
+        post = self.posts[4]
+        url = post.get_absolute_url()
+        # Счетчик разошелся с числом комментариев, страница уже в кеше
+        Post.objects.filter(pk=post.pk).update(active_comments=9)
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertContains(response, '9 comments')
+        etag = response['ETag']
+        call_command('recount_comments', stdout=StringIO())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '4 comments')
+        self.assertNotContains(response, '9 comments')
+
+
+class CursorPaginatorTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(5, 8):
+            Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=self.author,
+                                body='Body', status=Post.Status.PUBLISHED)
+        # Одинаковое время публикации: порядок страниц задает только id
+        Post.objects.update(publish=timezone.now() - timedelta(days=1))
+        self.paginator = CursorPaginator(Post.published.all(), 3)
+        self.ordered = list(Post.published.order_by('-publish', '-id')
+                            .values_list('id', flat=True))
+
+    def ids(self, page):
+        return [post.id for post in page]
+
+    def test_cursor_round_trip(self):
+        post = Post.published.get(id=self.ordered[2])
+        cursor = self.paginator.encode_cursor(post, NEXT, 2)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(self.paginator.decode_cursor(cursor), (NEXT, 2, [post.publish, post.id]))
+
+    def test_tampered_cursors_give_first_page(self):
+        def encode(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        publish = timezone.now().isoformat()
+        for cursor in ('garbage!', encode(['x', 2, [publish, '1']]), encode(['n', 2, [publish]]),
+                       encode(['n', 2, ['not a date', '1']]), encode(['n', 'two', [publish, '1']]),
+                       encode({'n': 2})):
+            with self.assertRaises(InvalidCursor):
+                self.paginator.decode_cursor(cursor)
+            page = self.paginator.page(cursor)
+            self.assertEqual((page.number, self.ids(page)), (1, self.ordered[:3]))
+
+    def test_next_and_previous_pages_with_equal_publish(self):
+        pages = [self.paginator.page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator.page(pages[-1].next_cursor))
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertEqual([post_id for page in pages for post_id in self.ids(page)], self.ordered)
+        self.assertEqual(pages[1].start_index(), 4)
+        page = self.paginator.page(pages[2].previous_cursor)
+        self.assertEqual((page.number, self.ids(page)), (2, self.ids(pages[1])))
+        self.assertTrue(page.has_next() and page.has_previous())
+        page = self.paginator.page(page.previous_cursor)
+        self.assertEqual((page.number, self.ids(page)), (1, self.ordered[:3]))
+        self.assertFalse(page.has_previous())
+
+    def test_previous_page_falls_back_to_first_page(self):
+        # Перед курсором осталось меньше страницы (посты сняты с публикации)
+        cursor = self.paginator.encode_cursor(Post.published.get(id=self.ordered[2]),
+                                              PREVIOUS, 5)
+        page = self.paginator.page(cursor)
+        self.assertEqual((page.number, self.ids(page)), (1, self.ordered[:3]))
+        self.assertFalse(page.has_previous())
+        self.assertIsNone(page.previous_cursor)
+
+
+@override_settings(BLOG_COMMENTS_PER_PAGE=3)
+class CommentPagesTests(BlogTestCase):
+    def test_pages_follow_cursor(self):
+        post = self.posts[4]
+        Comment.objects.filter(post=post, name='Reader 0').update(active=False)
+        Comment.objects.create(post=post, name='Reader 4',
+                               email='reader@example.com', body='Latest')
+        first = self.client.get(post.get_absolute_url()).context['comments']
+        self.assertEqual([comment.name for comment in first],
+                         ['Reader 1', 'Reader 2', 'Reader 3'])
+        url = f'/blog/{post.id}/comments/'
+        self.assertContains(self.client.get(post.get_absolute_url()),
+                            f'{url}?cursor=')
+        response = self.client.get(url, {'cursor': first.next_cursor})
+        self.assertEqual([comment.name for comment in response.context['comments']],
+                         ['Reader 4'])
+        self.assertContains(response, 'Comment 4 by Reader 4')
+        self.assertNotContains(response, 'More comments')
+
+    def test_json(self):
+        post = self.posts[4]
+        data = self.client.get(f'/blog/{post.id}/comments/', {'format': 'json'}).json()
+        comments = list(post.comments.order_by('created', 'id')[:3])
+        self.assertEqual(data['comments'], [{'id': comment.id,
+                                             'name': comment.name,
+                                             'body': comment.body,
+                                             'created': comment.created.isoformat()}
+                                            for comment in comments])
+        data = self.client.get(f'/blog/{post.id}/comments/',
+                               {'format': 'json', 'cursor': data['next']}).json()
+        self.assertEqual([comment['name'] for comment in data['comments']], ['Reader 3'])
+        self.assertIsNone(data['next'])
+
+    def test_missing_and_unpublished_posts(self):
+        self.assertEqual(self.client.get('/blog/999999/comments/').status_code, 404)
+        post = self.posts[4]
+        Post.objects.filter(pk=post.pk).update(status=Post.Status.DRAFT)
+        self.assertEqual(self.client.get(f'/blog/{post.id}/comments/').status_code, 404)
+
+
+class CommentQueueTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(BLOG_COMMENT_QUEUE=f'{directory.name}/queue.sqlite3')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def post_comment(self, post, **data):
+        data = {'name': 'Reader', 'email': 'reader@example.com', 'body': 'Hi', **data}
+        return self.client.post(f'/blog/{post.id}/comment/', data,
+                                HTTP_REFERER=f'http://testserver{post.get_absolute_url()}')
+
+    def test_comment_is_queued_after_post_lookup(self):
+        # Только проверка опубликованного поста по первичному ключу
+        with self.assertNumQueries(1):
+            response = self.post_comment(self.posts[0])
+        self.assertEqual(response.status_code, 202)
+        self.assertContains(response, self.posts[0].get_absolute_url(), status_code=202)
+        self.assertEqual(comment_queue.pending(), 1)
+        response = self.post_comment(self.posts[0], email='invalid')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(comment_queue.pending(), 1)
+
+    def test_comments_to_missing_posts_are_not_queued(self):
+        Post.objects.filter(pk=self.posts[0].pk).update(status=Post.Status.DRAFT)
+        self.assertEqual(self.post_comment(self.posts[0]).status_code, 404)
+        self.assertEqual(self.client.post('/blog/999999/comment/',
+                                          {'name': 'Reader', 'email': 'reader@example.com',
+                                           'body': 'Hi'}).status_code, 404)
+        self.assertEqual(comment_queue.pending(), 0)
+
+    def test_worker_saves_batch(self):
+        url = self.posts[1].get_absolute_url()
+        self.client.get(url)
+        for i in range(3):
+            self.post_comment(self.posts[1], body=f'Queued {i}')
+        self.post_comment(self.posts[2])
+        Post.objects.filter(pk=self.posts[2].pk).update(status=Post.Status.DRAFT)
+        self.assertEqual(comment_queue.process(batch_size=10), 4)
+        self.assertEqual(comment_queue.pending(), 0)
+        self.assertEqual(Comment.objects.filter(body__startswith='Queued').count(), 3)
+        self.assertFalse(Comment.objects.filter(post=self.posts[2], body='Hi').exists())
+        self.assertEqual(Post.objects.get(pk=self.posts[1].pk).active_comments, 4)
+        # Страница поста построена заново с новыми комментариями
+        self.assertContains(self.client.get(url), 'Queued 2')
+
+
+class IndexLockTests(BlogTestCase):
+    def test_lock_is_exclusive_and_removed_only_by_owner(self):
+        self.use_temporary_index_dir()
+        directory = index_dir('test')
+        with IndexLock(directory) as lock:
+            with self.assertRaises(TimeoutError):
+                with IndexLock(directory, timeout=0):
+                    pass
+            # Блокировку сочли устаревшей, и ее взял другой процесс
+            (directory / '.lock').write_text('other')
+        self.assertEqual((directory / '.lock').read_text(), 'other')
+        self.assertIsNone(lock.token)
+
+
+class IndexStorageTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_index_dir()
+        tfidf.build_index()
+        self.directory = index_dir('tfidf')
+
+    def test_previous_version_kept_until_next_switch(self):
+        tfidf.update_posts([self.posts[0].id])
+        first = read_json(self.directory / 'CURRENT')
+        tfidf.update_posts([self.posts[1].id])
+        self.assertTrue((self.directory / first['delta']).exists())
+        tfidf.update_posts([self.posts[2].id])
+        self.assertFalse((self.directory / first['delta']).exists())
+
+    def test_reader_with_removed_version_rereads_current(self):
+        tfidf.update_posts([self.posts[0].id])
+        stale = read_json(self.directory / 'CURRENT')
+        for post in self.posts[1:3]:
+            tfidf.update_posts([post.id])
+        self.assertFalse((self.directory / stale['delta']).exists())
+        tfidf._loaded.clear()
+        # Процесс прочитал CURRENT до двух переключений индекса
+        reads = [stale]
+
+        def read_stale_current(path, default=None):
+            if path.name == 'CURRENT' and reads:
+                return reads.pop()
+            return read_json(path, default)
+
+        with mock.patch('blog.tfidf.read_json', read_stale_current):
+            index = tfidf.get_index()
+        self.assertEqual(index.current, read_json(self.directory / 'CURRENT'))
+
+
+class TfidfIndexTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_index_dir()
+        tfidf.build_index()
+        self.directory = index_dir('tfidf')
+
+    def create_posts(self, bodies):
+        posts = [Post.objects.create(title=body.split()[0], slug=f'topic-{i}',
+                                     author=self.author, body=body,
+                                     status=Post.Status.PUBLISHED)
+                 for i, body in enumerate(bodies)]
+        tfidf.build_index()
+        return posts
+
+    def test_neighbours_follow_post_updates(self):
+        python, django, rust = self.create_posts([
+            'Python generators yield values lazily from iterators.',
+            'Python iterators and generators in Django querysets.',
+            'Rust ownership, borrowing, lifetimes.',
+        ])
+        self.assertEqual(tfidf.similar_post_ids(python.id, 1), [django.id])
+        self.assertEqual(tfidf.similar_post_ids(rust.id, 3), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            rust.body = 'Python generators yield values lazily from iterators too.'
+            rust.save()
+        self.assertEqual(tfidf.similar_post_ids(python.id, 2), [rust.id, django.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            rust.status = Post.Status.DRAFT
+            rust.save()
+        self.assertEqual(tfidf.similar_post_ids(python.id, 2), [django.id])
+        # После слияния дельты с базой соседи те же
+        tfidf.merge_delta(force=True)
+        self.assertEqual(tfidf.get_index().delta, {})
+        self.assertEqual(tfidf.similar_post_ids(python.id, 2), [django.id])
+
+    @override_settings(BLOG_SIMILAR_POSTS_SOURCE='content')
+    def test_post_detail_shows_content_neighbours(self):
+        python, django = self.create_posts([
+            'Python generators yield values lazily from iterators.',
+            'Python iterators and generators in Django querysets.',
+        ])
+        response = self.client.get(python.get_absolute_url())
+        self.assertEqual(response.context['similar_posts'][0], django)
+
+    @override_settings(BLOG_TFIDF_MAX_DELTA=1)
+    def test_delta_is_merged_by_command_not_on_save(self):
+        base = read_json(self.directory / 'CURRENT')['base']
+        for post in self.posts[:3]:
+            with self.captureOnCommitCallbacks(execute=True):
+                post.body = 'Rust ownership and borrowing.'
+                post.save()
+        self.assertEqual(read_json(self.directory / 'CURRENT')['base'], base)
+        self.assertEqual(len(tfidf.get_index().delta), 3)
+        out = StringIO()
+        call_command('build_tfidf_index', '--merge', stdout=out)
+        self.assertIn('Merged 3 post(s) into the base.', out.getvalue())
+        current = read_json(self.directory / 'CURRENT')
+        self.assertNotEqual(current['base'], base)
+        self.assertIsNone(current['delta'])
+        self.assertEqual(tfidf.get_index().delta, {})
+
+    def test_busy_lock_defers_update(self):
+        post = self.posts[0]
+        with mock.patch('blog.tfidf.UPDATE_LOCK_TIMEOUT', 0.01), IndexLock(self.directory):
+            # Сохранение поста не ждет слияния и не падает
+            tfidf.update_posts([post.id])
+        self.assertNotIn(post.id, tfidf.get_index().delta)
+        tfidf.update_posts([self.posts[1].id])
+        self.assertEqual(set(tfidf.get_index().delta), {post.id, self.posts[1].id})
+
+
+class SimilarPostsTests(BlogTestCase):
+    TAGS = [['python', 'django', 'web'], ['python', 'django'], ['python', 'web'],
+            ['django', 'web'], ['python'], ['rust', 'systems'], ['rust']]
+
+    def setUp(self):
+        super().setUp()
+        publish = timezone.now() - timedelta(days=1)
+        self.tagged = []
+        for i, tags in enumerate(self.TAGS):
+            post = Post.objects.create(title=f'Tagged {i}', slug=f'tagged-{i}',
+                                       author=self.author, body='Body',
+                                       status=Post.Status.PUBLISHED,
+                                       # Пары постов с одинаковым временем публикации
+                                       publish=publish - timedelta(hours=i // 2))
+            post.tags.add(*tags)
+            self.tagged.append(post)
+
+    def expected(self, post, k=4):
+        # Прежний запрос ORM: посты с общими тегами по числу общих тегов,
+        # затем по дате публикации и id
+        tag_ids = post.tags.values_list('id', flat=True)
+        similar = Post.published.filter(tags__in=tag_ids).exclude(id=post.id) \
+            .annotate(same_tags=Count('tags')).order_by('-same_tags', '-publish', '-id')[:k]
+        return [(other.id, other.same_tags) for other in similar]
+
+    def stored(self, post):
+        return list(SimilarPost.objects.filter(post=post).order_by('rank')
+                    .values_list('similar_id', 'shared_tags'))
+
+    def test_ranking_matches_orm_query(self):
+        build_similar_posts()
+        for post in Post.published.all():
+            self.assertEqual(self.stored(post), self.expected(post), post.title)
+        incidence = TagIncidence.load()
+        posts, similar, shared, ranks = incidence.top_k([self.tagged[0].id], 2)
+        self.assertEqual(similar.tolist(), [pair[0] for pair in self.expected(self.tagged[0], 2)])
+        self.assertEqual(ranks.tolist(), [0, 1])
+
+    def test_migration_backfills_similar_posts(self):
+        migration = import_module('blog.migrations.0015_backfill_similar_posts')
+        SimilarPost.objects.all().delete()
+        migration.backfill_similar_posts(apps, None)
+        for post in Post.published.all():
+            self.assertEqual(self.stored(post), self.expected(post), post.title)
+
+    def test_neighbourhood(self):
+        rust, only_rust = self.tagged[5], self.tagged[6]
+        self.assertEqual(neighbourhood([rust.id]), {rust.id, only_rust.id})
+        # Удаленный тег добавляет посты, у которых он остался
+        python = Tag.objects.get(name='python')
+        with_python = {post.id for post, tags in zip(self.tagged, self.TAGS) if 'python' in tags}
+        self.assertEqual(neighbourhood([only_rust.id], [python.id]),
+                         {rust.id, only_rust.id} | with_python)
+
+    def test_incremental_update_rewrites_only_affected_posts(self):
+        build_similar_posts()
+        rust = self.tagged[5]
+        untouched = {post.id: list(SimilarPost.objects.filter(post=post).values_list('pk', flat=True))
+                     for post in self.tagged[:5]}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tagged[6].tags.add('systems')
+        for post in Post.published.all():
+            self.assertEqual(self.stored(post), self.expected(post), post.title)
+        # Списки постов без тегов rust и systems не перезаписывались
+        for post_id, pks in untouched.items():
+            self.assertEqual(list(SimilarPost.objects.filter(post_id=post_id)
+                                  .values_list('pk', flat=True)), pks)
+        self.assertEqual(self.stored(rust), [(self.tagged[6].id, 2)])
+
+
+class QueryBudgetTests(BlogTestCase):
+    # Число запросов к БД на холодном кеше, включая три запроса боковой
+    # панели. Оно не должно зависеть от числа постов, тегов и комментариев.
+    def test_post_list(self):
+        with self.assertNumQueries(5):
+            self.client.get('/blog/')
+
+    def test_post_list_by_tag(self):
+        with self.assertNumQueries(6):
+            self.client.get('/blog/tag/common/')
+
+    def test_post_detail(self):
+        with self.assertNumQueries(6):
+            self.client.get(self.posts[4].get_absolute_url())
+
+    def test_post_share(self):
+        with self.assertNumQueries(4):
+            self.client.get(f'/blog/{self.posts[4].id}/share/')
+
+    def test_post_feed(self):
+        with self.assertNumQueries(3):
+            self.client.get('/blog/feed/')
+        with self.assertNumQueries(0):
+            self.client.get('/blog/feed/')
+
+    def test_post_feed_by_tag(self):
+        with self.assertNumQueries(4):
+            self.client.get('/blog/tag/common/feed/')
+
+    def test_post_search(self):
+        with self.assertNumQueries(6):
+            self.client.get('/blog/search/', {'query': 'body'})
+
+    def test_budget_does_not_grow_with_page_content(self):
+        for post in self.posts:
+            post.tags.add('extra-1', 'extra-2', 'extra-3')
+        with self.assertNumQueries(5):
+            self.client.get('/blog/')
+
+
+class PostDetailLookupTests(BlogTestCase):
+    def test_lookup_uses_slug_publish_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.posts[0].get_absolute_url())
+        sql = next(query['sql'] for query in queries
+                   if '"blog_post"."slug" =' in query['sql'])
+        self.assertIn('blog_post_slug_publish_idx', self.explain(sql))
+
+    def test_comments_use_post_active_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.posts[4].get_absolute_url())
+        sql = next(query['sql'] for query in queries
+                   if 'FROM "blog_comment"' in query['sql'])
+        plan = self.explain(sql)
+        self.assertIn('blog_comment_post_active_idx', plan)
+        # Порядок created берется из индекса, без отдельной сортировки
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('TEMP B-TREE', plan)
+        else:
+            self.assertNotIn('Sort', plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plan')
+    def test_comments_of_post_use_foreign_key_index(self):
+        # Выборка и каскадное удаление всех комментариев поста, включая
+        # неактивные, не просматривают таблицу целиком
+        for sql in (f'SELECT * FROM blog_comment WHERE post_id = {self.posts[4].id}',
+                    f'DELETE FROM blog_comment WHERE post_id IN ({self.posts[4].id})'):
+            plan = self.explain(sql)
+            self.assertIn('blog_comment_post_id', plan)
+            self.assertNotIn('SCAN blog_comment', plan)
+
+    def test_detail_url_matches_only_publish_date(self):
+        post = self.posts[0]
+        publish = timezone.localtime(post.publish)
+        self.assertEqual(self.client.get(post.get_absolute_url()).status_code, 200)
+        other_day = publish + timedelta(days=1)
+        url = f'/blog/{other_day.year}/{other_day.month}/{other_day.day}/{post.slug}/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(f'/blog/2023/2/30/{post.slug}/').status_code, 404)
+        for date in ('9999/12/31', '99999999999999999999/1/1'):
+            self.assertEqual(self.client.get(f'/blog/{date}/{post.slug}/').status_code, 404)
+
+
+class SearchCacheTests(BlogTestCase):
+    def search(self, query):
+        response = self.client.get('/blog/search/', {'query': query})
+        return [post.id for post in response.context['results']]
+
+    def test_normalized_queries_share_results(self):
+        results = self.search('Post  3')
+        # Только загрузка найденных постов, без обращения к поисковому индексу
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search('\uff30ost 3 '), results)
+        self.assertEqual(search_stats(), {'hits': 1, 'misses': 1})
+
+    def test_published_post_changes_invalidate_results(self):
+        self.search('kubernetes')
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(title='Draft about Kubernetes', slug='draft',
+                                author=self.author, body='Body')
+        self.assertEqual(self.search('kubernetes'), [])
+        self.assertEqual(search_stats()['hits'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='Kubernetes', slug='kubernetes',
+                                       author=self.author, body='Body',
+                                       status=Post.Status.PUBLISHED)
+        self.assertEqual(self.search('kubernetes'), [post.id])
+
+    def test_evicted_generation_does_not_revive_results(self):
+        self.search('kubernetes')
+        # Номер поколения вытеснен из кеша раньше списков результатов
+        cache.delete(GENERATION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='Kubernetes', slug='kubernetes',
+                                       author=self.author, body='Body',
+                                       status=Post.Status.PUBLISHED)
+        self.assertEqual(self.search('kubernetes'), [post.id])
+
+
+@override_settings(BLOG_SEARCH_MAX_RESULTS=3, BLOG_SEARCH_RESULTS_PER_PAGE=2)
+class SearchPaginationTests(BlogTestCase):
+    def test_results_are_capped_and_paginated(self):
+        response = self.client.get('/blog/search/', {'query': 'post'})
+        self.assertContains(response, 'Found more than 3 results')
+        self.assertEqual(len(response.context['results']), 2)
+        # Следующая страница берется из кешированного списка идентификаторов;
+        # загружаются только ее посты и их фрагменты
+        with self.assertNumQueries(2):
+            response = self.client.get('/blog/search/', {'query': 'post', 'page': 2})
+        self.assertEqual(len(response.context['results']), 1)
+        self.assertContains(response, 'Page 2 of 2.')
+
+
+class SearchSnippetTests(BlogTestCase):
+    def test_snippets_are_highlighted_escaped_and_cached(self):
+        post = self.posts[0]
+        post.body = 'Intro. <script>alert(1)</script> Kubernetes operators & more.'
+        post.save()
+        response = self.client.get('/blog/search/', {'query': 'kubernetes'})
+        self.assertContains(response, '<mark>Kubernetes</mark> operators &amp; more')
+        self.assertContains(response, '&lt;script&gt;')
+        self.assertNotContains(response, '<script>alert')
+        with self.assertNumQueries(1):
+            self.client.get('/blog/search/', {'query': ' KUBERNETES'})
+
+
+class AutocompleteTests(BlogTestCase):
+    def suggest(self, prefix):
+        response = self.client.get('/blog/search/suggest/', {'q': prefix})
+        return [(item['type'], item['label']) for item in response.json()['suggestions']]
+
+    def test_titles_and_tags_by_prefix(self):
+        self.assertEqual(self.suggest('POST 1'), [('post', 'Post 1')])
+        self.assertEqual(self.suggest('tag-3'), [('tag', 'tag-3')])
+        self.assertEqual(self.suggest('1'), [('post', 'Post 1')])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_warm_index_does_not_query_database(self):
+        self.suggest('post')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.suggest('post')), 5)
+
+    def test_index_is_updated_incrementally(self):
+        self.suggest('post')
+        post = self.posts[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            post.title = 'Kubernetes operators'
+            post.save()
+            self.posts[1].delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('oper'), [('post', 'Kubernetes operators')])
+            self.assertEqual(self.suggest('post'), [('post', 'Post 2'), ('post', 'Post 3'),
+                                                    ('post', 'Post 4')])
+
+    def test_busy_lock_defers_update(self):
+        self.use_temporary_index_dir()
+        self.suggest('post')
+        post = self.posts[0]
+        with mock.patch('blog.search.autocomplete.LOCK_TIMEOUT', 0.01), \
+                IndexLock(index_dir('autocomplete')):
+            with self.captureOnCommitCallbacks(execute=True):
+                post.title = 'Kubernetes operators'
+                post.save()
+            # Пока блокировка занята, выдается прежний список
+            self.assertEqual(self.suggest('oper'), [])
+        self.assertEqual(self.suggest('oper'), [('post', 'Kubernetes operators')])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('oper'), [('post', 'Kubernetes operators')])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL full-text search')
+class PostgresSearchTests(BlogTestCase):
+    def test_search_vector_is_maintained_on_save(self):
+        post = self.posts[0]
+        post.title = 'Kubernetes operators'
+        post.save()
+        response = self.client.get('/blog/search/', {'query': 'kubernetes'})
+        self.assertEqual([p.id for p in response.context['results']], [post.id])
+
+    def test_typos_fall_back_to_title_similarity(self):
+        response = self.client.get('/blog/search/', {'query': 'Pots 3'})
+        self.assertIn(self.posts[3], list(response.context['results']))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 search')
+class SqliteSearchTests(BlogTestCase):
+    def search(self, query):
+        response = self.client.get('/blog/search/', {'query': query})
+        return [post.id for post in response.context['results']]
+
+    def test_index_follows_post_changes(self):
+        post = self.posts[0]
+        post.title = 'Kubernetes operators'
+        post.save()
+        self.assertEqual(self.search('kubernetes'), [post.id])
+        post.status = Post.Status.DRAFT
+        post.save()
+        self.assertEqual(self.search('kubernetes'), [])
+        post.delete()
+        self.assertEqual(self.search('kubernetes'), [])
+
+    def test_prefix_and_title_ranking(self):
+        self.posts[1].body = 'Body text. ' * 20 + 'Kubernetes'
+        self.posts[1].save()
+        self.posts[2].title = 'Kubernetes'
+        self.posts[2].save()
+        self.assertEqual(self.search('kuber'), [self.posts[2].id, self.posts[1].id])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('"post OR* NEAR('), [])
+
+
+@override_settings(BLOG_SEARCH_BACKEND='blog.search.inverted.InvertedIndexSearchBackend')
+class InvertedIndexSearchTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_index_dir()
+        build_index()
+
+    def search(self, query):
+        response = self.client.get('/blog/search/', {'query': query})
+        return [post.id for post in response.context['results']]
+
+    def test_bm25_ranking(self):
+        self.assertEqual(self.search('post 3'), [self.posts[3].id] + [
+            post.id for post in reversed(self.posts) if post != self.posts[3]])
+        self.assertEqual(self.search('missing'), [])
+
+    def test_journal_follows_post_changes(self):
+        post = self.posts[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            post.title = 'Kubernetes operators'
+            post.save()
+        self.assertEqual(self.search('kubernetes'), [post.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertEqual(self.search('kubernetes'), [])
+        build_index()
+        self.assertEqual(self.search('kubernetes'), [])
+
+    @override_settings(BLOG_SEARCH_MAX_JOURNAL=1)
+    def test_compaction_runs_outside_post_saves(self):
+        for post in self.posts[:2]:
+            with self.captureOnCommitCallbacks(execute=True):
+                post.title = f'Kubernetes {post.id}'
+                post.save()
+        self.assertEqual(len(inverted.get_index().journal), 2)
+        out = StringIO()
+        call_command('rebuild_search_index', '--compact', stdout=out)
+        self.assertIn('Indexed 5 post(s).', out.getvalue())
+        self.assertEqual(inverted.get_index().journal, {})
+        self.assertEqual(sorted(self.search('kubernetes')), [post.id for post in self.posts[:2]])
+        call_command('rebuild_search_index', '--compact', stdout=out)
+        self.assertIn('Index is up to date.', out.getvalue())
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_search', posts=50, vocabulary=100, queries=10, stdout=out)
+        self.assertIn('Built index of 50 post(s)', out.getvalue())
+        self.assertIn('10 queries: p50', out.getvalue())
+
+    def test_changes_during_rebuild_are_kept(self):
+        post = self.posts[0]
+        write_base = inverted._write_base
+
+        def write_base_during_change(directory, posts):
+            name = write_base(directory, posts)
+            # Пост изменен после чтения постов, но до переключения индекса
+            Post.objects.filter(pk=post.pk).update(title='Kubernetes operators')
+            inverted.update_posts([post.id])
+            return name
+
+        with mock.patch('blog.search.inverted._write_base', write_base_during_change):
+            build_index()
+        self.assertEqual(self.search('kubernetes'), [post.id])
+
+    def test_rebuild_keeps_other_process_temp_files(self):
+        temp = index_dir('inverted') / '.base-in-progress'
+        temp.mkdir()
+        build_index()
+        self.assertTrue(temp.exists())
+
+    def test_snippets(self):
+        response = self.client.get('/blog/search/', {'query': 'post 3'})
+        self.assertContains(response, 'Body of <mark>post</mark> <mark>3</mark>.')
+
+
+class SpellingSuggestionTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_index_dir()
+        spelling.build_index()
+
+    def test_suggestion_for_misspelled_query(self):
+        response = self.client.get('/blog/search/', {'query': 'Bdoy of psot'})
+        self.assertEqual(response.context['suggestion'], 'body of post')
+        self.assertContains(response, '<a href="?query=body%20of%20post">body of post</a>')
+
+    def test_no_suggestion_for_known_or_unknown_words(self):
+        self.assertIsNone(spelling.suggest('body'))
+        self.assertIsNone(spelling.suggest('kubernetes'))
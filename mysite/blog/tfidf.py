@@ -0,0 +1,355 @@
+"""
+Схожие посты по содержимому: векторы TF-IDF по заголовку и телу поста
+и поиск ближайших соседей по косинусной мере.
+
+Индекс хранится в каталоге BLOG_INDEX_DIR/tfidf и отображается в память
+каждым рабочим процессом:
+* base-<версия>/ – словарь, idf и разреженная матрица документов в двух
+  представлениях: по строкам (документ -> термы) и по столбцам
+  (терм -> документы), каждое в виде массивов indptr/indices/weights;
+* delta-<версия>.npz – небольшой набор векторов постов, измененных после
+  построения базы; он перекрывает строки базы;
+* CURRENT – имена действующих базы и дельты.
+Команда build_tfidf_index строит индекс заново, сигналы сохранения
+и удаления постов обновляют дельту, а периодически запускаемая команда
+build_tfidf_index --merge сливает выросшую дельту с базой.
+"""
+import io
+import os
+import re
+import time
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from .index_storage import (IndexLock, atomic_write, index_dir, read_json,
+                            switch_version, write_json)
+from .models import Post
+from .similarity import concat_ranges
+
+TOKEN_RE = re.compile(r'\w+')
+# Посты, не попавшие в дельту из-за занятой блокировки индекса
+PENDING = '.pending'
+# Ожидание блокировки индекса в update_posts, секунды
+UPDATE_LOCK_TIMEOUT = 1
+ARRAYS = ['idf', 'doc_ids', 'doc_indptr', 'doc_terms', 'doc_weights',
+          'term_indptr', 'term_docs', 'term_weights']
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower())
+            if len(token) > 1 and not token.isdigit()]
+
+
+def post_terms(title, body):
+    # Слова заголовка учитываются дважды
+    return tokenize(title) * 2 + tokenize(body)
+
+
+def vectorize(terms, vocabulary, idf):
+    """
+    Нормированный вектор TF-IDF: (номера термов по возрастанию, веса).
+    Термы вне словаря отбрасываются."""
+    counts = Counter(vocabulary[term] for term in terms if term in vocabulary)
+    if not counts:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    term_ids = np.array(sorted(counts), dtype=np.int32)
+    tf = np.array([counts[term_id] for term_id in term_ids.tolist()], dtype=np.float32)
+    weights = (1 + np.log(tf)) * idf[term_ids]
+    weights /= np.linalg.norm(weights)
+    return term_ids, weights.astype(np.float32)
+
+
+def _transpose(doc_indptr, doc_terms, doc_weights, vocabulary_size):
+    rows = np.repeat(np.arange(len(doc_indptr) - 1, dtype=np.int32),
+                     np.diff(doc_indptr))
+    order = np.lexsort((rows, doc_terms))
+    term_indptr = np.concatenate(
+        ([0], np.cumsum(np.bincount(doc_terms, minlength=vocabulary_size))))
+    return term_indptr.astype(np.int64), rows[order], doc_weights[order]
+
+
+def _stack(vectors):
+    lengths = [len(terms) for terms, _ in vectors]
+    indptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    if not vectors:
+        return indptr, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    return (indptr,
+            np.concatenate([terms for terms, _ in vectors]).astype(np.int32),
+            np.concatenate([weights for _, weights in vectors]).astype(np.float32))
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # Пустой массив нельзя отобразить в память
+        return np.load(path)
+
+
+class TfidfIndex:
+    def __init__(self, directory, current):
+        self.directory = directory
+        self.current = current
+        base = directory / current['base']
+        self.terms = read_json(base / 'vocabulary.json', [])
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+        for name in ARRAYS:
+            setattr(self, name, _load_array(base / f'{name}.npy'))
+        self.delta = {}
+        if current.get('delta'):
+            with np.load(directory / current['delta']) as data:
+                indptr = data['indptr']
+                for i, post_id in enumerate(data['ids'].tolist()):
+                    start, end = indptr[i], indptr[i + 1]
+                    self.delta[post_id] = (data['terms'][start:end],
+                                           data['weights'][start:end])
+        # Строки базы, перекрытые дельтой (измененные и удаленные посты)
+        positions = np.searchsorted(self.doc_ids, list(self.delta))
+        self.overridden = np.array([
+            position for position, post_id in zip(positions.tolist(), self.delta)
+            if position < len(self.doc_ids) and self.doc_ids[position] == post_id
+        ], dtype=np.int64)
+
+    def base_position(self, post_id):
+        position = int(np.searchsorted(self.doc_ids, post_id))
+        if position < len(self.doc_ids) and self.doc_ids[position] == post_id:
+            return position
+        return None
+
+    def vector(self, post_id):
+        if post_id in self.delta:
+            return self.delta[post_id]
+        position = self.base_position(post_id)
+        if position is None:
+            return None
+        start, end = self.doc_indptr[position], self.doc_indptr[position + 1]
+        return self.doc_terms[start:end], self.doc_weights[start:end]
+
+    def similar(self, post_id, k):
+        """
+        Идентификаторы k постов, ближайших к post_id по косинусной мере."""
+        vector = self.vector(post_id)
+        if vector is None or not len(vector[0]):
+            return []
+        terms, weights = vector
+        lengths = np.diff(self.term_indptr)[terms]
+        postings = concat_ranges(self.term_indptr[terms], lengths)
+        scores = np.bincount(self.term_docs[postings],
+                             weights=self.term_weights[postings] * np.repeat(weights, lengths),
+                             minlength=len(self.doc_ids))
+        scores[self.overridden] = 0
+        position = self.base_position(post_id)
+        if position is not None:
+            scores[position] = 0
+        top = np.argpartition(-scores, min(k, len(scores) - 1))[:k] if len(scores) else []
+        candidates = [(float(scores[i]), int(self.doc_ids[i])) for i in top if scores[i] > 0]
+        for other_id, (other_terms, other_weights) in self.delta.items():
+            if other_id == post_id or not len(other_terms):
+                continue
+            _, mine, theirs = np.intersect1d(terms, other_terms,
+                                             assume_unique=True, return_indices=True)
+            score = float(np.dot(weights[mine], other_weights[theirs]))
+            if score > 0:
+                candidates.append((score, other_id))
+        candidates.sort(key=lambda item: (-item[0], -item[1]))
+        return [post_id for _, post_id in candidates[:k]]
+
+
+_loaded = {}
+
+
+def get_index():
+    """
+    Индекс текущей версии или None, если он еще не построен. Версия
+    проверяется по файлу CURRENT при каждом обращении, так что изменения,
+    сделанные другим процессом, подхватываются без перезапуска."""
+    directory = index_dir('tfidf')
+    for attempt in range(2):
+        current = read_json(directory / 'CURRENT')
+        if current is None:
+            return None
+        index = _loaded.get(directory)
+        if index is not None and index.current == current:
+            return index
+        try:
+            index = _loaded[directory] = TfidfIndex(directory, current)
+            return index
+        except FileNotFoundError:
+            # Файлы версии удалены после чтения CURRENT: за это время
+            # индекс переключался дважды, читаем CURRENT заново
+            if attempt:
+                raise
+
+
+def similar_post_ids(post_id, k):
+    index = get_index()
+    if index is None:
+        return None
+    return index.similar(post_id, k)
+
+
+def _version():
+    return f'{time.time_ns():x}'
+
+
+def _write_base(directory, terms, idf, doc_ids, vectors):
+    doc_indptr, doc_terms, doc_weights = _stack(vectors)
+    term_indptr, term_docs, term_weights = _transpose(doc_indptr, doc_terms,
+                                                      doc_weights, len(terms))
+    name = f'base-{_version()}'
+    tmp = directory / f'.{name}'
+    tmp.mkdir()
+    write_json(tmp / 'vocabulary.json', terms)
+    arrays = {'idf': idf, 'doc_ids': np.asarray(doc_ids, dtype=np.int64),
+              'doc_indptr': doc_indptr, 'doc_terms': doc_terms,
+              'doc_weights': doc_weights, 'term_indptr': term_indptr,
+              'term_docs': term_docs, 'term_weights': term_weights}
+    for array_name, array in arrays.items():
+        np.save(tmp / f'{array_name}.npy', array)
+    os.replace(tmp, directory / name)
+    return name
+
+
+def build_index():
+    """
+    Строит индекс по всем опубликованным постам. Возвращает число документов."""
+    max_terms = getattr(settings, 'BLOG_TFIDF_MAX_TERMS', 50000)
+    max_df = getattr(settings, 'BLOG_TFIDF_MAX_DF', 0.5)
+    posts = Post.published.order_by('id').values_list('id', 'title', 'body')
+    document_frequency = Counter()
+    total = 0
+    for _, title, body in posts.iterator(chunk_size=500):
+        document_frequency.update(set(post_terms(title, body)))
+        total += 1
+    # Слишком частые слова не различают посты и раздувают списки
+    limit = max(1, int(max_df * total)) if total > 1 else total
+    terms = [term for term, df in document_frequency.most_common()
+             if df <= limit][:max_terms]
+    terms.sort()
+    vocabulary = {term: i for i, term in enumerate(terms)}
+    df = np.array([document_frequency[term] for term in terms], dtype=np.float32)
+    idf = (np.log((1 + total) / (1 + df)) + 1).astype(np.float32)
+    doc_ids, vectors = [], []
+    for post_id, title, body in posts.iterator(chunk_size=500):
+        doc_ids.append(post_id)
+        vectors.append(vectorize(post_terms(title, body), vocabulary, idf))
+    directory = index_dir('tfidf')
+    with IndexLock(directory):
+        # Посты из дельты могли измениться во время чтения: их векторы
+        # вычисляются заново по новой базе
+        changed = set(_take_pending(directory))
+        index = get_index()
+        if index is not None:
+            changed.update(index.delta)
+        base = _write_base(directory, terms, idf, doc_ids, vectors)
+        switch_version(directory, {'base': base, 'delta': None})
+        if changed:
+            _update_delta(directory, changed)
+    return total
+
+
+def _add_pending(directory, post_ids):
+    # Одна короткая запись в режиме добавления, без блокировки индекса
+    with open(directory / PENDING, 'a', encoding='utf-8') as f:
+        f.write(''.join(f'{post_id}\n' for post_id in post_ids))
+
+
+def _take_pending(directory):
+    taken = directory / f'{PENDING}.{os.getpid()}'
+    try:
+        os.replace(directory / PENDING, taken)
+    except FileNotFoundError:
+        return []
+    with open(taken, encoding='utf-8') as f:
+        post_ids = [int(line) for line in f if line.strip()]
+    os.remove(taken)
+    return post_ids
+
+
+def _updated_delta(directory, post_ids):
+    # Дельта текущей версии с векторами постов post_ids и отложенных постов
+    post_ids = set(post_ids) | set(_take_pending(directory))
+    posts = dict((post_id, (title, body)) for post_id, title, body in
+                 Post.published.filter(id__in=post_ids)
+                 .values_list('id', 'title', 'body'))
+    index = get_index()
+    delta = dict(index.delta)
+    for post_id in post_ids:
+        if post_id in posts:
+            delta[post_id] = vectorize(post_terms(*posts[post_id]),
+                                       index.vocabulary, index.idf)
+        else:
+            delta[post_id] = vectorize([], {}, index.idf)
+    return index, delta
+
+
+def _update_delta(directory, post_ids):
+    index, delta = _updated_delta(directory, post_ids)
+    switch_version(directory, {'base': index.current['base'],
+                               'delta': _write_delta(directory, delta)})
+
+
+def update_posts(post_ids):
+    """
+    Обновляет векторы постов в дельте индекса (с прежними словарем и idf).
+    Неопубликованные и удаленные посты исключаются из индекса.
+
+    Вызывается после сохранения поста, поэтому блокировку индекса ждет
+    недолго: если ее держат слияние или перестройка, посты откладываются
+    в файл .pending и попадают в дельту при следующем обновлении."""
+    directory = index_dir('tfidf')
+    if read_json(directory / 'CURRENT') is None:
+        return
+    try:
+        with IndexLock(directory, timeout=UPDATE_LOCK_TIMEOUT):
+            _update_delta(directory, post_ids)
+    except TimeoutError:
+        _add_pending(directory, post_ids)
+
+
+def merge_delta(force=False):
+    """
+    Сливает дельту с базой, если в ней больше BLOG_TFIDF_MAX_DELTA постов
+    (или непустую дельту при force). Возвращает число слитых постов или None.
+    Выполняется командой build_tfidf_index --merge, а не при сохранении
+    поста: слияние перезаписывает всю базу."""
+    directory = index_dir('tfidf')
+    with IndexLock(directory):
+        if get_index() is None:
+            return None
+        index, delta = _updated_delta(directory, [])
+        if not delta or not force and len(delta) <= getattr(settings, 'BLOG_TFIDF_MAX_DELTA', 500):
+            if delta.keys() != index.delta.keys():
+                # Отложенные посты записываются в дельту и без слияния
+                switch_version(directory, {'base': index.current['base'],
+                                           'delta': _write_delta(directory, delta)})
+            return None
+        switch_version(directory, {'base': _merge(directory, index, delta), 'delta': None})
+    return len(delta)
+
+
+def _write_delta(directory, delta):
+    ids = sorted(delta)
+    indptr, terms, weights = _stack([delta[post_id] for post_id in ids])
+    buffer = io.BytesIO()
+    np.savez(buffer, ids=np.array(ids, dtype=np.int64), indptr=indptr,
+             terms=terms, weights=weights)
+    name = f'delta-{_version()}.npz'
+    atomic_write(directory / name, buffer.getvalue())
+    return name
+
+
+def _merge(directory, index, delta):
+    # Слияние дельты с базой: строки базы, перекрытые дельтой, заменяются,
+    # посты с пустыми векторами (удаленные) выбрасываются
+    documents = {}
+    for position, post_id in enumerate(index.doc_ids.tolist()):
+        if post_id not in delta:
+            start, end = index.doc_indptr[position], index.doc_indptr[position + 1]
+            documents[post_id] = (index.doc_terms[start:end], index.doc_weights[start:end])
+    documents.update((post_id, vector) for post_id, vector in delta.items()
+                     if len(vector[0]))
+    doc_ids = sorted(documents)
+    return _write_base(directory, index.terms, np.asarray(index.idf), doc_ids,
+                       [documents[post_id] for post_id in doc_ids])
@@ -1,6 +1,12 @@
 from django.urls import path
 from . import views
-from .feeds import LatestPostsFeed
+from .caching import cache_anonymous_page, conditional_page
+from .feeds import AtomLatestPostsFeed, AtomTagPostsFeed, LatestPostsFeed, TagPostsFeed
+
+
+def feed(view):
+    return conditional_page('posts', 'tags')(cache_anonymous_page('list')(view))
+
 
 app_name = 'blog'
 """
@@ -29,9 +35,20 @@ urlpatterns = [
          views.post_share, name='post_share'),
     path('<int:post_id>/comment/',
          views.post_comment, name='post_comment'),
+    path('<int:post_id>/comments/',
+         views.post_comments, name='post_comments'),
     path('tag/<slug:tag_slug>/',
          views.post_list, name='post_list_by_tag'),
-    path('feed/', LatestPostsFeed(), name='post_feed'),
+    path('archive/<int:year>/<int:month>/',
+         views.post_list, name='post_list_by_month'),
+    # Ленты зависят только от постов и тегов: ответ 304 по меткам изменений,
+    # иначе готовый XML из кеша
+    path('feed/', feed(LatestPostsFeed()), name='post_feed'),
+    path('feed/atom/', feed(AtomLatestPostsFeed()), name='post_feed_atom'),
+    path('tag/<slug:tag_slug>/feed/', feed(TagPostsFeed()), name='post_feed_by_tag'),
+    path('tag/<slug:tag_slug>/feed/atom/', feed(AtomTagPostsFeed()),
+         name='post_feed_by_tag_atom'),
     path('search/', views.post_search, name='post_search'),
+    path('search/suggest/', views.post_search_suggest, name='post_search_suggest'),
 
 ]
@@ -1,17 +1,28 @@
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils import timezone
+from django.utils.http import url_has_allowed_host_and_scheme
+from . import comment_queue
+from .caching import cache_anonymous_page, conditional_page
 from .models import Post, Comment
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from .pagination import CursorPaginator
+from .search import autocomplete, search, snippets, spelling
+from .similarity import similar_posts_count
+from . import tfidf
 from django.views.generic import ListView
 from .forms import EmailPostForm, CommentForm, SearchForm
 from django.core.mail import send_mail
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 from taggit.models import Tag
-from django.db.models import Count
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank, TrigramSimilarity
 
 
-def post_list(request, tag_slug=None):
-    post_list = Post.published.all()
+@conditional_page()
+@cache_anonymous_page('list')
+def post_list(request, tag_slug=None, year=None, month=None):
+    post_list = Post.published.for_listing().with_related()
     """
    Представление принимает опциональный параметр tag_slug, значение
 которого по умолчанию равно None. Этот параметр будет передан в URL-
@@ -34,77 +45,56 @@ def post_list(request, tag_slug=None):
     if tag_slug:
         tag = get_object_or_404(Tag, slug=tag_slug)
         post_list = post_list.filter(tags__in=[tag])
-    paginator = Paginator(post_list, 3)
-    page_number = request.GET.get('page', 1)
-    # posts = paginator.page(page_number)  # Мы создаем экземпляр класса Paginator с числом объектов, возвраща-
-    # емых в расчете на страницу. Мы будем отображать по три поста на
-    # страницу.
-    # 2. Мы извлекаем HTTP GET-параметр page и сохраняем его в переменной
-    # page_number. Этот параметр содержит запрошенный номер страницы.
-    # Если параметра page нет в GET-параметрах запроса, то мы используем
-    # стандартное значение 1, чтобы загрузить первую страницу результатов.
-    # 3. Мы получаем объекты для желаемой страницы, вызывая метод page()
-    # класса Paginator. Этот метод возвращает объект Page, который хранится
-    # в переменной posts.
-    # 4. Мы передаем номер страницы и объект posts в шаблон.
-
-    try:
-        posts = paginator.page(page_number)
-    except PageNotAnInteger:
-        # Если page_number не целое число, то
-        # выдать первую страницу
-        posts = paginator.page(1)
-    except EmptyPage:
-        # Если page_number находится вне диапазона, то
-        # выдать последнюю страницу результатов
-        posts = paginator.page(paginator.num_pages)
+    archive = None
+    if year is not None:
+        # Архив за месяц: диапазон дат публикации читается по индексу publish
+        try:
+            archive = date(year, month, 1)
+            start = timezone.make_aware(datetime(year, month, 1))
+            end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+        except (ValueError, OverflowError):
+            raise Http404('No such month.')
+        post_list = post_list.filter(publish__gte=start, publish__lt=end)
+    # Разбивка по курсору: вместо COUNT(*) и OFFSET выбираются посты,
+    # идущие в порядке (-publish, -id) после последнего показанного
+    paginator = CursorPaginator(post_list, 3)
+    posts = paginator.page(request.GET.get('cursor'))
 
     return render(request,
                   'blog/post/list.html',
                   {'posts': posts,
-                   'tag': tag})
+                   'tag': tag,
+                   'archive': archive})
 
 
 # Если page_number находится вне диапазона, то
 # выдать последнюю страницу
 
 
+@conditional_page(csrf=True)
+@cache_anonymous_page('post')
 def post_detail(request, year, month, day, post):
-    post = get_object_or_404(Post,
-                             status=Post.Status.PUBLISHED,
+    # Диапазон [начало дня, начало следующего дня) в текущем часовом поясе
+    # вместо publish__year/month/day: сравнение с самим полем publish
+    # позволяет использовать индекс (slug, publish)
+    try:
+        day_start = datetime(year, month, day)
+        start = timezone.make_aware(day_start)
+        end = timezone.make_aware(day_start + timedelta(days=1))
+    except (ValueError, OverflowError):
+        # Несуществующая дата или выход за пределы datetime (9999-12-31)
+        raise Http404('No Post matches the given query.')
+    post = get_object_or_404(Post.published.select_related('author').defer('search_vector'),
                              slug=post,
-                             publish__year=year,
-                             publish__month=month,
-                             publish__day=day,
+                             publish__gte=start,
+                             publish__lt=end,
                              )
-    # Список активных комментариев к этому посту
-    comments = post.comments.filter(active=True)
+    # Первая страница активных комментариев к этому посту; общее число
+    # берется из счетчика post.active_comments
+    comments = comment_paginator(post.comments.all()).first_page()
     # Форма для комментирования пользователями
     form = CommentForm()
-    # Список схожих постов
-    post_tags_ids = post.tags.values_list('id', flat=True)
-    similar_posts = Post.published.filter(tags__in=post_tags_ids) \
-        .exclude(id=post.id)
-    similar_posts = similar_posts.annotate(same_tags=Count('tags')) \
-                        .order_by('-same_tags', '-publish')[:4]
-    """
-    Приведенный выше исходный код делает следующее:
-1) извлекается Python’овский список идентификаторов тегов текущего
-поста. Набор запросов QuerySet values_list() возвращает кортежи со
-значениями заданных полей. Ему передается параметр flat=True, чтобы
-получить одиночные значения, такие как [1, 2, 3, ...], а не одноэле-
-ментые кортежи, такие как [(1,), (2,), (3,) ...];
-2) берутся все посты, содержащие любой из этих тегов, за исключением
-текущего поста;
-3) применяется функция агрегирования Count. Ее работа – генерировать
-вычисляемое поле – same_tags, – которое содержит число тегов, общих
-со всеми запрошенными тегами;
-4) результат упорядочивается по числу общих тегов (в убывающем по-
-рядке) и по publish, чтобы сначала отображать последние посты для
-постов с одинаковым числом общих тегов. Результат нарезается, чтобы
-получить только первые четыре поста;
-5) объект similar_posts передается в контекстный словарь для функции
-render()."""
+    similar_posts = get_similar_posts(post)
     return render(request,
                   'blog/post/detail.html',
                   {'post': post,
@@ -114,15 +104,65 @@ render()."""
                    })
 
 
+def get_similar_posts(post):
+    if settings.BLOG_SIMILAR_POSTS_SOURCE == 'content':
+        # Ближайшие по содержимому посты из индекса TF-IDF (blog/tfidf.py)
+        post_ids = tfidf.similar_post_ids(post.id, similar_posts_count())
+        if post_ids is not None:
+            posts = Post.published.for_listing().in_bulk(post_ids)
+            return [posts[post_id] for post_id in post_ids if post_id in posts]
+    # Список схожих постов, заранее рассчитанный по общим тегам
+    # (blog/similarity.py, команда build_similar_posts)
+    return [link.similar for link in
+            post.similar_links.filter(similar__status=Post.Status.PUBLISHED)
+            .select_related('similar')
+            .defer('similar__body', 'similar__body_html', 'similar__search_vector')]
+
+
+def comment_paginator(comments):
+    return CursorPaginator(comments.filter(active=True),
+                           settings.BLOG_COMMENTS_PER_PAGE,
+                           ordering=('created', 'id'))
+
+
+@require_GET
+@conditional_page('posts', 'comments')
+def post_comments(request, post_id):
+    """
+    Следующая страница комментариев поста: HTML-фрагмент для detail.html
+    или JSON при ?format=json."""
+    post = get_object_or_404(Post.published.only('id'), id=post_id)
+    page = comment_paginator(post.comments.all()).page(request.GET.get('cursor'))
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'comments': [{'id': comment.id,
+                          'name': comment.name,
+                          'body': comment.body,
+                          'created': comment.created.isoformat()}
+                         for comment in page],
+            'next': page.next_cursor,
+        })
+    return render(request,
+                  'blog/post/includes/comment_list.html',
+                  {'comments': page,
+                   'post_id': post.id})
+
+
 class PostListView(ListView):
     """
     Альтернативное представление списка постов
     """
-    queryset = Post.published.all()
+    queryset = Post.published.for_listing().with_related()
     context_object_name = 'posts'
     paginate_by = 3
     template_name = 'blog/post/list.html'
 
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size)
+        page = paginator.page(self.request.GET.get('cursor'))
+        # Шаблон list.html ожидает в переменной posts объект страницы
+        return paginator, page, page, page.has_other_pages()
+
 
 """
 атрибут queryset используется для того, чтобы иметь конкретно-при-
@@ -184,12 +224,21 @@ def post_share(request, post_id):
 
 @require_POST
 def post_comment(request, post_id):
-    post = get_object_or_404(Post,
-                             id=post_id,
-                             status=Post.Status.PUBLISHED)
+    # Поиск по первичному ключу: пост проверяется и перед постановкой
+    # комментария в очередь, чтобы она не заполнялась мусором
+    post = get_object_or_404(Post.published, id=post_id)
+    form = CommentForm(data=request.POST)
+    if comment_queue.enabled() and form.is_valid():
+        # Комментарий сохранит обработчик очереди (process_comment_queue);
+        # в ответ – короткое подтверждение
+        comment_queue.enqueue(post.id, form.cleaned_data)
+        back_url = request.META.get('HTTP_REFERER')
+        if not url_has_allowed_host_and_scheme(back_url, {request.get_host()}):
+            back_url = None
+        return render(request, 'blog/post/comment_queued.html',
+                      {'back_url': back_url}, status=202)
     comment = None
     # Комментарий был отправлен
-    form = CommentForm(data=request.POST)
     if form.is_valid():
         # Создать объект класса Comment, не сохраняя его в базе данных
         comment = form.save(commit=False)
@@ -237,22 +286,47 @@ def post_search(request):
     form = SearchForm()
     query = None
     results = []
+    page = None
+    truncated = False
+    suggestion = None
     if 'query' in request.GET:
         form = SearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['query']
-            search_vector = SearchVector('title', weight='A') + \
-                            SearchVector('body', weight='B')
-            search_query = SearchQuery(query)
-            results = Post.published.annotate(
-                similarity=TrigramSimilarity('title', query),
-            ).filter(similarity__gt=0.1).order_by('-similarity')
+            # Ранжированные идентификаторы постов из поисковой реализации
+            # для текущей СУБД (blog/search, с кешем результатов), не больше
+            # BLOG_SEARCH_MAX_RESULTS. Страницы нарезаются из этого списка,
+            # и загружаются только посты текущей страницы
+            post_ids, truncated = search(query)
+            page = Paginator(post_ids, settings.BLOG_SEARCH_RESULTS_PER_PAGE) \
+                .get_page(request.GET.get('page'))
+            posts = Post.published.for_listing().in_bulk(page.object_list)
+            results = [posts[post_id] for post_id in page.object_list if post_id in posts]
+            # Фрагменты с выделенными словами запроса – тоже только для
+            # постов этой страницы
+            highlighted = snippets(page.object_list, query)
+            for post in results:
+                post.snippet = highlighted.get(post.id)
+            if not post_ids:
+                # «Did you mean»: исправление запроса по словарю блога
+                suggestion = spelling.suggest(query)
 
     return render(request,
                   'blog/post/search.html',
                   {'form': form,
                    'query': query,
-                   'results': results})
+                   'results': results,
+                   'page': page,
+                   'truncated': truncated,
+                   'suggestion': suggestion})
+
+
+@require_GET
+def post_search_suggest(request):
+    """
+    Подсказки для поля поиска: заголовки постов и теги, JSON. Отвечает
+    из индекса в памяти процесса, без запросов к БД."""
+    return JsonResponse({'suggestions': autocomplete.complete(request.GET.get('q', ''))})
 
 
 """
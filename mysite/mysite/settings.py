@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -95,6 +96,26 @@ DATABASES = {
     }
 }
 
+# Cache
+# Кеш должен быть общим для всех рабочих процессов: записи сбрасываются
+# сигналами, и сброс в одном процессе должен быть виден остальным.
+# Файловый кеш разделяется процессами одного сервера; для нескольких
+# серверов укажите здесь Memcached или Redis.
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('BLOG_CACHE_LOCATION', BASE_DIR / 'var' / 'cache'),
+        # По умолчанию FileBasedCache хранит 300 файлов и при переполнении
+        # удаляет треть случайных записей: страниц, фрагментов и результатов
+        # поиска больше, и кеш постоянно прореживался бы
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('BLOG_CACHE_MAX_ENTRIES', 20000)),
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -141,3 +162,53 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # EMAIL_USE_TLS = True
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Блог: расширения Markdown, с которыми прорисовывается тело поста.
+# После их изменения выполните python manage.py rerender_posts
+BLOG_MARKDOWN_EXTENSIONS = []
+BLOG_MARKDOWN_EXTENSION_CONFIGS = {}
+
+# Каталог файлов поисковых индексов (TF-IDF и др.), общий для рабочих процессов
+BLOG_INDEX_DIR = os.environ.get('BLOG_INDEX_DIR', BASE_DIR / 'var' / 'index')
+
+# Источник блока «Similar posts»: 'tags' – по общим тегам (build_similar_posts),
+# 'content' – по содержимому, TF-IDF (build_tfidf_index)
+BLOG_SIMILAR_POSTS_SOURCE = 'tags'
+
+# Число комментариев на странице post_detail и фрагмента post_comments
+BLOG_COMMENTS_PER_PAGE = 20
+
+# Полностраничный кеш для анонимных посетителей (blog/caching.py): время
+# жизни записи в секундах и хранение страниц в заранее сжатом виде для gzip
+BLOG_PAGE_CACHE_TIMEOUT = 600
+BLOG_PAGE_CACHE_GZIP = True
+
+# Поисковая реализация post_search (путь к классу, см. blog/search).
+# None – по СУБД: PostgreSQL или SQLite FTS5
+BLOG_SEARCH_BACKEND = None
+# Встроенный индекс ('blog.search.inverted.InvertedIndexSearchBackend'):
+# число записей журнала, после которого индекс перестраивает периодически
+# запускаемая команда rebuild_search_index --compact, и число документов,
+# хранимых для частых термов
+BLOG_SEARCH_MAX_JOURNAL = 1000
+BLOG_SEARCH_CHAMPIONS = 1000
+# Время жизни кешированных результатов поиска, секунды
+BLOG_SEARCH_CACHE_TIMEOUT = 3600
+# Подсказки поиска (blog/search/autocomplete.py): число подсказок в ответе
+# и время жизни общего списка в кеше, секунды
+BLOG_AUTOCOMPLETE_LIMIT = 10
+BLOG_AUTOCOMPLETE_TIMEOUT = 86400
+# Поиск: не больше BLOG_SEARCH_MAX_RESULTS лучших результатов на запрос,
+# по BLOG_SEARCH_RESULTS_PER_PAGE на странице
+BLOG_SEARCH_MAX_RESULTS = 200
+BLOG_SEARCH_RESULTS_PER_PAGE = 10
+
+# Число адресов в одном разделе карты сайта (sitemap-<раздел>.xml?p=<номер>)
+BLOG_SITEMAP_SECTION_SIZE = 5000
+
+# Очередь новых комментариев (blog/comment_queue.py): файл SQLite, из которого
+# комментарии сохраняет python manage.py process_comment_queue. Включайте
+# очередь, только если обработчик запущен постоянно (process_comment_queue
+# --interval N как служба), иначе комментарии не появятся на сайте.
+# None – комментарии сохраняются сразу в post_comment
+BLOG_COMMENT_QUEUE = os.environ.get('BLOG_COMMENT_QUEUE') or None
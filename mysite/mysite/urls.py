@@ -1,15 +1,21 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.contrib.sitemaps.views import sitemap
-from blog.sitemaps import PostSitemap  # Абсолютный импорт
+from blog.caching import conditional_page
+from blog import sitemaps as blog_sitemaps
+from blog.sitemaps import ArchiveSitemap, PostSitemap, TagSitemap  # Абсолютный импорт
 
 sitemaps = {
     'posts': PostSitemap,
+    'tags': TagSitemap,
+    'archive': ArchiveSitemap,
 }
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('blog/', include('blog.urls', namespace='blog')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps},
-         name='django.contrib.sitemaps.views.sitemap'),
+    # Индекс карты сайта и ее разделы (blog/sitemaps.py)
+    path('sitemap.xml', conditional_page('posts', 'tags')(blog_sitemaps.index),
+         {'sitemaps': sitemaps}, name='sitemap'),
+    path('sitemap-<section>.xml', conditional_page('posts', 'tags')(blog_sitemaps.section),
+         {'sitemaps': sitemaps}, name='sitemap_section'),
 ]